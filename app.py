@@ -1,43 +1,65 @@
 import base64
+import binascii
+import csv
 
 from dotenv import load_dotenv
 import os
 import json
 import traceback
 import re
-from urllib.parse import quote_plus
+from urllib.parse import quote_plus, urlparse, unquote
+import mimetypes
+import threading
+import multiprocessing
+import atexit
+import hashlib
+import random
+import sqlite3
+import shutil
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
 import time
-from sqlalchemy.exc import OperationalError
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session as OrmSession
+from sqlalchemy.exc import IntegrityError, OperationalError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 os.environ['OAUTHLIB_RELAX_TOKEN_SCOPE'] = '1'
-from flask import Flask, flash, jsonify, render_template, request, redirect, url_for, session, send_file, send_from_directory
+from flask import Flask, Response, flash, jsonify, render_template, request, redirect, url_for, session, send_file, send_from_directory, stream_with_context, has_request_context, has_app_context, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from werkzeug.utils import secure_filename
-from datetime import datetime, date, timedelta
+from datetime import datetime, date, timedelta, MINYEAR, MAXYEAR
 import io
 import zipfile
 import subprocess
 from flask import jsonify
-import tempfile
-from flask import send_file, make_response, request
+from flask import send_file, request
 from googleapiclient.http import MediaIoBaseDownload
 
 try:
-    from weasyprint import HTML
+    from weasyprint import HTML, default_url_fetcher
 except:
     HTML = None
+    default_url_fetcher = None
 from flask import redirect, url_for, flash
 from config import COMPANIES
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from humanize import intword
+from PIL import Image
 from google.oauth2 import service_account
 from googleapiclient.discovery import build  
-from googleapiclient.http import MediaFileUpload  
+from googleapiclient.http import MediaFileUpload, build_http
+from googleapiclient.errors import HttpError
+from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
 from google.oauth2.credentials import Credentials 
 from google_auth_oauthlib.flow import Flow  
 import pickle
 import uuid
+import click
 from num2words import num2words
 from googleapiclient.http import MediaIoBaseDownload
 
@@ -46,15 +68,25 @@ app.secret_key = "super-secret-key"
 
 load_dotenv()
 
-# Database configuration for Hostinger VPS
+# ========== DATABASE CONFIGURATION ==========
+# DATABASE_URL wins when set (mysql+pymysql://... or sqlite:////path/to/file.db).
+# Next DB_BACKEND=sqlite runs on a local SQLite file for benchmarking and tests on
+# a box without MySQL, even when .env has the DB_* credentials. Otherwise the DB_*
+# variables build the Hostinger MySQL URI.
 DB_HOST = os.getenv('DB_HOST', 'localhost')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_NAME = os.getenv('DB_NAME', 'lcs_doc_generator')
 
-# If credentials are provided via environment variables, use them.
-# Otherwise fall back to local development (optional).
-if DB_USER and DB_PASSWORD:
+DATABASE_URI = os.getenv('DATABASE_URL')
+if DATABASE_URI:
+    print(f"✅ Using DATABASE_URL ({make_url(DATABASE_URI).get_backend_name()})")
+elif os.getenv('DB_BACKEND', '').lower() == 'sqlite':
+    sqlite_path = os.path.abspath(os.getenv('DB_SQLITE_PATH', os.path.join(app.instance_path, 'doc_generator.db')))
+    os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
+    DATABASE_URI = f'sqlite:///{sqlite_path}'
+    print(f"✅ Using local SQLite database: {sqlite_path}")
+elif DB_USER and DB_PASSWORD:
     # URL-encode the password to handle special characters
     encoded_password = quote_plus(DB_PASSWORD)
     DATABASE_URI = f'mysql+pymysql://{DB_USER}:{encoded_password}@{DB_HOST}/{DB_NAME}'
@@ -67,21 +99,94 @@ else:
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URI
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-# Add connection pool settings
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-    'pool_size': 3,
-    'pool_recycle': 180,        # Recycle every 3 minutes
-    'pool_pre_ping': True,      # Verify connection before using
-    'pool_use_lifo': True,
-    'max_overflow': 5,
-    'connect_args': {
-        'connect_timeout': 10,
-        'read_timeout': 30,
-        'write_timeout': 30
+# Connection pool settings, tunable per deployment
+app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 3))
+app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 5))
+app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 180))      # seconds, recycle every 3 minutes
+app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))       # seconds to wait for a free connection
+app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes')
+app.config['DB_CONNECT_TIMEOUT'] = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
+app.config['DB_READ_TIMEOUT'] = int(os.getenv('DB_READ_TIMEOUT', 30))
+app.config['DB_WRITE_TIMEOUT'] = int(os.getenv('DB_WRITE_TIMEOUT', 30))
+app.config['SQLITE_BUSY_TIMEOUT'] = int(os.getenv('SQLITE_BUSY_TIMEOUT', 30))  # seconds a writer waits for the lock
+
+# Checkout counters for the connection pool, served by /admin/db-stats
+DB_POOL_STATS = {'checkouts': 0, 'overflow_checkouts': 0, 'timeouts': 0,
+                 'wait_total_ms': 0.0, 'wait_max_ms': 0.0, 'peak_overflow': 0}
+_db_pool_stats_lock = threading.Lock()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited and how far it went into overflow"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            with _db_pool_stats_lock:
+                DB_POOL_STATS['timeouts'] += 1
+            raise
+        waited_ms = (time.perf_counter() - started) * 1000
+        overflow = self.overflow()
+        with _db_pool_stats_lock:
+            DB_POOL_STATS['checkouts'] += 1
+            DB_POOL_STATS['wait_total_ms'] += waited_ms
+            DB_POOL_STATS['wait_max_ms'] = max(DB_POOL_STATS['wait_max_ms'], waited_ms)
+            if overflow > 0:
+                DB_POOL_STATS['overflow_checkouts'] += 1
+                DB_POOL_STATS['peak_overflow'] = max(DB_POOL_STATS['peak_overflow'], overflow)
+        return connection
+
+
+def database_engine_options(uri):
+    """SQLAlchemy engine options for the configured backend and pool settings"""
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            # In-memory databases live on a single shared connection
+            return {'connect_args': {'check_same_thread': False}}
+        return {
+            'poolclass': MeteredQueuePool,
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'connect_args': {
+                'check_same_thread': False,
+                'timeout': app.config['SQLITE_BUSY_TIMEOUT']
+            }
+        }
+    return {
+        'poolclass': MeteredQueuePool,
+        'pool_size': app.config['DB_POOL_SIZE'],
+        'max_overflow': app.config['DB_MAX_OVERFLOW'],
+        'pool_recycle': app.config['DB_POOL_RECYCLE'],
+        'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+        'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        'pool_use_lifo': True,
+        'connect_args': {
+            'connect_timeout': app.config['DB_CONNECT_TIMEOUT'],
+            'read_timeout': app.config['DB_READ_TIMEOUT'],
+            'write_timeout': app.config['DB_WRITE_TIMEOUT']
+        }
     }
-}
 
-print(f"✅ Database configured: {app.config['SQLALCHEMY_DATABASE_URI'][:50]}...")
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    """WAL lets readers keep going while a writer commits; NORMAL sync is safe under WAL"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute(f"PRAGMA busy_timeout={app.config['SQLITE_BUSY_TIMEOUT'] * 1000}")
+    cursor.close()
+
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(DATABASE_URI)
+
+print(f"✅ Database configured: {make_url(DATABASE_URI).render_as_string(hide_password=True)[:50]}...")
 
 app.config['UPLOAD_FOLDER'] = os.path.join(app.root_path, "generated_docs")
 # Google Drive Configuration
@@ -137,7 +242,7 @@ def execute_with_retry(func, retries=3, delay=2):
 def health_check():
     """Health check endpoint for Render"""
     try:
-        db.session.execute(text('SELECT 1'))
+        db.session.execute(db.text('SELECT 1'))
         return jsonify({'status': 'healthy', 'database': 'connected'}), 200
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
@@ -159,6 +264,9 @@ class Admin(db.Model):
 
 class IncrementHistory(db.Model):
     __tablename__ = 'increment_history'
+    __table_args__ = (
+        db.Index('ix_increment_history_employee_generated', 'employee_id', 'generated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id', ondelete='CASCADE'), nullable=False)
@@ -176,6 +284,11 @@ class IncrementHistory(db.Model):
 
 #employee model
 class Employee(db.Model):
+    __table_args__ = (
+        db.Index('ix_employee_status_created', 'status', 'created_at'),
+        db.Index('ix_employee_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.String(20), unique=True, nullable=False)
     full_name = db.Column(db.String(100), nullable=False)
@@ -189,6 +302,9 @@ class Employee(db.Model):
     department = db.Column(db.String(100))
     drive_folder_id = db.Column(db.String(100), nullable=True)
     base_ctc = db.Column(db.Float, default=0)
+    # Denormalized from increment_history, kept current by refresh_ctc()
+    current_ctc = db.Column(db.Float, nullable=True)
+    total_monthly_increment = db.Column(db.Float, default=0)
     joining_date = db.Column(db.Date, nullable=True)
     resignation_date = db.Column(db.Date, nullable=True)
     status = db.Column(db.String(20), default='active')
@@ -215,13 +331,28 @@ class Employee(db.Model):
 
     @property
     def ctc(self):
-        """Calculate current CTC based on base_ctc and increments"""
+        """Current CTC: base_ctc plus all increments, read from current_ctc when it is set"""
+        if self.current_ctc is not None:
+            return self.current_ctc
         total_increment = sum([inc.increment_amount for inc in self.increment_history])
         base = self.base_ctc if self.base_ctc is not None else 0
         return base + (total_increment * 12)
 
+    def refresh_ctc(self):
+        """Recompute current_ctc / total_monthly_increment after increment_history or base_ctc changes"""
+        db.session.flush()
+        total_increment = db.session.query(
+            db.func.coalesce(db.func.sum(IncrementHistory.increment_amount), 0)
+        ).filter(IncrementHistory.employee_id == self.id).scalar()
+        self.total_monthly_increment = float(total_increment)
+        self.current_ctc = (self.base_ctc or 0) + (self.total_monthly_increment * 12)
+
 # Document Model to Track Generated Documents
 class Document(db.Model):
+    __table_args__ = (
+        db.Index('ix_document_employee_generated', 'employee_id', 'generated_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     document_type = db.Column(db.String(50))
@@ -234,6 +365,13 @@ class Document(db.Model):
     drive_file_id = db.Column(db.String(100), nullable=True)  # To store Google Drive file ID
 
 class Payment(db.Model):
+    __table_args__ = (
+        db.Index('ix_payment_status_created', 'status', 'created_at'),
+        db.Index('ix_payment_employee_created', 'employee_id', 'created_at'),
+        db.Index('ix_payment_payment_date', 'payment_date'),
+        db.Index('ix_payment_created_at', 'created_at'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=False)
     document_id = db.Column(db.Integer, db.ForeignKey('document.id'), nullable=True)
@@ -274,6 +412,9 @@ class Company(db.Model):
 #intern model
 class Intern(db.Model):
     __tablename__ = 'interns'
+    __table_args__ = (
+        db.Index('ix_interns_created_at', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     intern_id = db.Column(db.String(20), unique=True, nullable=False)
@@ -315,6 +456,9 @@ class Intern(db.Model):
 #intern documents model
 class InternDocument(db.Model):
     __tablename__ = 'intern_documents'
+    __table_args__ = (
+        db.Index('ix_intern_documents_intern_generated', 'intern_id', 'generated_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     intern_id = db.Column(db.Integer, db.ForeignKey('interns.id'), nullable=False)
@@ -325,6 +469,701 @@ class InternDocument(db.Model):
     generated_by = db.Column(db.String(80))
     drive_file_id = db.Column(db.String(100), nullable=True)
 
+# Background document generation jobs (see run_generation / generation workers)
+class GenerationJob(db.Model):
+    __tablename__ = 'generation_job'
+    __table_args__ = (
+        db.Index('ix_generation_job_status_created', 'status', 'created_at'),
+    )
+
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    status = db.Column(db.String(20), default='queued')  # queued, running, done, failed
+    document_type = db.Column(db.String(50))
+    payload = db.Column(db.Text, nullable=False)        # JSON snapshot of the session/form state
+    result = db.Column(db.Text, nullable=True)          # JSON generation_result()
+    error = db.Column(db.Text, nullable=True)
+    progress_done = db.Column(db.Integer, default=0)
+    progress_total = db.Column(db.Integer, default=0)
+    progress_message = db.Column(db.String(200), nullable=True)
+    attempts = db.Column(db.Integer, default=0)
+    worker = db.Column(db.String(100), nullable=True)
+    created_by = db.Column(db.String(80))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'document_type': self.document_type,
+            'progress': {
+                'done': self.progress_done or 0,
+                'total': self.progress_total or 0,
+                'message': self.progress_message,
+            },
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'attempts': self.attempts or 0,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+# Version counters bumped on writes so every process can drop its in-memory copies
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_version'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+# Materialized dashboard numbers, kept in step with writes (see DASHBOARD COUNTERS)
+class DashboardCounter(db.Model):
+    __tablename__ = 'dashboard_counter'
+
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+# Drive folder IDs by owner folder name and subfolder path (see DRIVE FOLDER MAP)
+class DriveFolder(db.Model):
+    __tablename__ = 'drive_folder'
+    __table_args__ = (
+        db.UniqueConstraint('owner', 'path', name='uq_drive_folder_owner_path'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)
+    path = db.Column(db.String(255), nullable=False, default='')  # '' is the owner's own folder
+    folder_id = db.Column(db.String(100), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    verified_at = db.Column(db.DateTime, nullable=True)
+
+# Generated documents waiting to be copied to Google Drive (see DRIVE UPLOAD OUTBOX)
+class DriveUpload(db.Model):
+    __tablename__ = 'drive_upload'
+    __table_args__ = (
+        db.Index('ix_drive_upload_status_next', 'status', 'next_attempt_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    document_kind = db.Column(db.String(20), nullable=False)  # 'employee' (Document) or 'intern' (InternDocument)
+    document_id = db.Column(db.Integer, nullable=False)
+    folder = db.Column(db.String(255), nullable=False, default='')
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, uploading, done, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text, nullable=True)
+    worker = db.Column(db.String(100), nullable=True)
+    drive_file_id = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'document_kind': self.document_kind,
+            'document_id': self.document_id,
+            'folder': self.folder,
+            'status': self.status,
+            'attempts': self.attempts or 0,
+            'last_error': self.last_error,
+            'drive_file_id': self.drive_file_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'next_attempt_at': self.next_attempt_at.isoformat() if self.next_attempt_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+# ========== DASHBOARD LOADERS ==========
+# Grouped aggregate queries used by list pages instead of per-row lookups
+
+def document_counts_by_employee(ids=None):
+    """{employee.id: document count} in one GROUP BY query, optionally for `ids` only"""
+    query = db.session.query(Document.employee_id, db.func.count(Document.id))
+    if ids is not None:
+        query = query.filter(Document.employee_id.in_(ids))
+    return dict(query.group_by(Document.employee_id).all())
+
+def document_counts_by_intern(ids=None):
+    """{intern.id: document count} in one GROUP BY query, optionally for `ids` only"""
+    query = db.session.query(InternDocument.intern_id, db.func.count(InternDocument.id))
+    if ids is not None:
+        query = query.filter(InternDocument.intern_id.in_(ids))
+    return dict(query.group_by(InternDocument.intern_id).all())
+
+def latest_increment_by_employee(ids=None):
+    """{employee.id: latest increment_amount} in one grouped query, optionally for `ids` only"""
+    latest_at = db.session.query(
+        IncrementHistory.employee_id,
+        db.func.max(IncrementHistory.generated_at).label('latest_at')
+    )
+    if ids is not None:
+        latest_at = latest_at.filter(IncrementHistory.employee_id.in_(ids))
+    latest_at = latest_at.group_by(IncrementHistory.employee_id).subquery()
+    latest_rows = (
+        db.session.query(IncrementHistory.employee_id, IncrementHistory.increment_amount)
+        .join(latest_at, db.and_(
+            IncrementHistory.employee_id == latest_at.c.employee_id,
+            IncrementHistory.generated_at == latest_at.c.latest_at
+        ))
+        .order_by(IncrementHistory.id)
+        .all()
+    )
+    # Rows are in id order, so the newest row wins a generated_at tie
+    return {employee_id: amount for employee_id, amount in latest_rows}
+
+def employee_counts_by_company():
+    """[(company name, employee count)] in one grouped query"""
+    rows = (
+        db.session.query(Company.name, db.func.count(Employee.id))
+        .select_from(Employee)
+        .outerjoin(Company, Employee.company_id == Company.id)
+        .group_by(Company.name)
+        .order_by(Company.name)
+        .all()
+    )
+    return [(name or 'No Company Assigned', count) for name, count in rows]
+
+def employee_cards(employees):
+    """Dashboard card data for `employees` with their document counts and latest increment"""
+    ids = [emp.id for emp in employees]
+    document_counts = document_counts_by_employee(ids)
+    latest_increments = latest_increment_by_employee(ids)
+    return [{
+        'employee': emp,
+        'document_count': document_counts.get(emp.id, 0),
+        'increment_amount': latest_increments.get(emp.id, 0),
+        'ctc': emp.ctc
+    } for emp in employees]
+
+@app.cli.command('verify-ctc')
+@click.option('--fix', is_flag=True, help='Rewrite drifted rows from increment_history')
+def verify_ctc_command(fix):
+    """Compare employee.current_ctc / total_monthly_increment with increment_history"""
+    totals = (
+        db.session.query(
+            IncrementHistory.employee_id,
+            db.func.sum(IncrementHistory.increment_amount).label('total')
+        )
+        .group_by(IncrementHistory.employee_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(Employee, db.func.coalesce(totals.c.total, 0))
+        .outerjoin(totals, totals.c.employee_id == Employee.id)
+        .all()
+    )
+
+    drifted = 0
+    for employee, total_increment in rows:
+        expected_ctc = (employee.base_ctc or 0) + (total_increment * 12)
+        if (employee.current_ctc is not None
+                and abs(employee.current_ctc - expected_ctc) < 0.01
+                and abs((employee.total_monthly_increment or 0) - total_increment) < 0.01):
+            continue
+        drifted += 1
+        print(f"❌ {employee.employee_id}: current_ctc={employee.current_ctc} expected={expected_ctc:.2f}, "
+              f"total_monthly_increment={employee.total_monthly_increment} expected={total_increment:.2f}")
+        if fix:
+            employee.total_monthly_increment = float(total_increment)
+            employee.current_ctc = expected_ctc
+
+    if fix and drifted:
+        db.session.commit()
+        print(f"✅ Repaired {drifted} of {len(rows)} employees")
+    elif drifted:
+        raise click.ClickException(f"{drifted} of {len(rows)} employees have drifted CTC totals (rerun with --fix)")
+    else:
+        print(f"✅ CTC totals consistent for {len(rows)} employees")
+
+# ========== KEYSET PAGINATION ==========
+# Long lists are paged on (created_at, id), newest first. A page cursor encodes
+# the boundary row, so every page is an index range scan however deep it is.
+# Rows without a timestamp sort last, as MySQL and SQLite order NULLs in DESC.
+app.config['PAYMENTS_PER_PAGE'] = int(os.getenv('PAYMENTS_PER_PAGE', 50))
+app.config['MEMBERS_PER_PAGE'] = int(os.getenv('MEMBERS_PER_PAGE', 24))
+app.config['DOCUMENTS_PER_PAGE'] = int(os.getenv('DOCUMENTS_PER_PAGE', 25))
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat() if created_at else ''}|{row_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """(created_at, id) from a page cursor, or None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        stamp, row_id = raw.rsplit('|', 1)
+        return (datetime.fromisoformat(stamp) if stamp else None), int(row_id)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+
+def keyset_page(query, created_col, id_col, per_page, prefix=''):
+    """One page of `query` ordered by (created_col, id_col) descending.
+
+    Reads the `<prefix>after` / `<prefix>before` cursors from the request and
+    returns (rows, page) where page carries the cursors for the next and
+    previous pages.
+    """
+    after = decode_cursor(request.args.get(prefix + 'after'))
+    before = None if after else decode_cursor(request.args.get(prefix + 'before'))
+
+    if before:
+        created, row_id = before
+        if created is None:
+            query = query.filter(db.or_(created_col.isnot(None),
+                                        db.and_(created_col.is_(None), id_col > row_id)))
+        else:
+            query = query.filter(db.or_(created_col > created,
+                                        db.and_(created_col == created, id_col > row_id)))
+        query = query.order_by(created_col.asc(), id_col.asc())
+    else:
+        if after:
+            created, row_id = after
+            if created is None:
+                query = query.filter(created_col.is_(None), id_col < row_id)
+            else:
+                query = query.filter(db.or_(created_col < created,
+                                            db.and_(created_col == created, id_col < row_id),
+                                            created_col.is_(None)))
+        query = query.order_by(created_col.desc(), id_col.desc())
+
+    rows = query.limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before:
+        rows.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = bool(after), more
+    if not rows:
+        has_prev = has_next = False
+
+    def cursor_for(row):
+        return encode_cursor(getattr(row, created_col.key), getattr(row, id_col.key))
+
+    return rows, {
+        'prefix': prefix,
+        'per_page': per_page,
+        'paged': bool(after or before),
+        'has_next': has_next,
+        'has_prev': has_prev,
+        'next_cursor': cursor_for(rows[-1]) if has_next else None,
+        'prev_cursor': cursor_for(rows[0]) if has_prev else None,
+    }
+
+@app.template_global()
+def keyset_url(page, direction):
+    """Link to the next / previous / newest ('first') page, keeping the other query arguments"""
+    args = request.args.to_dict()
+    args.pop(page['prefix'] + 'after', None)
+    args.pop(page['prefix'] + 'before', None)
+    if direction == 'next':
+        args[page['prefix'] + 'after'] = page['next_cursor']
+    elif direction == 'prev':
+        args[page['prefix'] + 'before'] = page['prev_cursor']
+    return url_for(request.endpoint, **dict(request.view_args or {}, **args))
+
+# ========== PAYMENT SUMMARIES ==========
+# Payment totals and per-status counts are computed with GROUP BY in the
+# database; the payment lists only fetch the page of rows they display.
+PAYMENT_STATUSES = ('Paid', 'Pending', 'Partial', 'Overdue')
+
+def payment_period_ranges(month=None, year=None, years=()):
+    """Half-open [start, end) payment_date ranges for a month and/or year filter.
+    A month without a year covers that month in each of `years`."""
+    def month_range(y, m):
+        start = date(y, m, 1)
+        return start, (date(y + 1, 1, 1) if m == 12 else date(y, m + 1, 1))
+
+    if month and year:
+        return [month_range(year, month)]
+    if year:
+        return [(date(year, 1, 1), date(year + 1, 1, 1))]
+    if month:
+        return [month_range(y, month) for y in years]
+    return []
+
+def payment_period_filter(month=None, year=None, years=()):
+    """payment_date filter for a month/year that keeps undated payments.
+
+    Written as plain range comparisons rather than EXTRACT() so the
+    payment_date index serves both the date ranges and the IS NULL branch.
+    """
+    return db.or_(
+        Payment.payment_date.is_(None),
+        *[db.and_(Payment.payment_date >= start, Payment.payment_date < end)
+          for start, end in payment_period_ranges(month, year, years)]
+    )
+
+def payment_date_years():
+    """Every year between the oldest and newest payment_date (an index lookup each end)"""
+    first, last = db.session.query(
+        db.func.min(Payment.payment_date), db.func.max(Payment.payment_date)
+    ).one()
+    if not first:
+        return range(0)
+    return range(first.year, last.year + 1)
+
+PAYMENT_STATUS_CLASSES = {
+    'Paid': 'success',
+    'Partial': 'warning',
+    'Overdue': 'danger',
+    'Pending': 'secondary',
+}
+
+def payment_status_class(status):
+    """Badge colour for a stored payment status"""
+    return PAYMENT_STATUS_CLASSES.get(status, 'secondary')
+
+def payment_summary(filters=()):
+    """Totals, per-status counts and per-status amounts due for the payments
+    matching `filters`, in one GROUP BY on the stored status"""
+    rows = (
+        db.session.query(
+            Payment.status,
+            db.func.count(Payment.id),
+            db.func.coalesce(db.func.sum(Payment.amount), 0),
+            db.func.coalesce(db.func.sum(Payment.paid_amt), 0)
+        )
+        .filter(*filters)
+        .group_by(Payment.status)
+        .all()
+    )
+
+    summary = {
+        'count': 0,
+        'total_amount': 0,
+        'total_paid': 0,
+        'counts': dict.fromkeys(PAYMENT_STATUSES, 0),
+        'due': dict.fromkeys(PAYMENT_STATUSES, 0),
+    }
+    for status_value, count, amount, paid in rows:
+        summary['count'] += count
+        summary['total_amount'] += amount
+        summary['total_paid'] += paid
+        summary['counts'][status_value] = summary['counts'].get(status_value, 0) + count
+        summary['due'][status_value] = summary['due'].get(status_value, 0) + amount - paid
+    summary['total_due'] = summary['total_amount'] - summary['total_paid']
+    return summary
+
+# ========== DASHBOARD COUNTERS ==========
+# The dashboard header reads a handful of dashboard_counter rows instead of
+# counting tables. Every ORM flush that adds, changes or deletes employees,
+# interns, documents or payments applies the matching deltas in the same
+# transaction; bulk statements call adjust_dashboard_counters() themselves.
+# The migration seeds them; `flask rebuild-dashboard-counters` recomputes
+# everything from the tables.
+COUNTERS_BUILT = 'meta:built_at'
+
+def _counter_status(status):
+    return status if status is not None else ''
+
+def _counter_contributions(obj, old=False):
+    """{counter name: amount} that one row contributes, from its current or pre-flush values"""
+    def value(attr):
+        if old:
+            history = db.inspect(obj).attrs[attr].history
+            if history.deleted:
+                return history.deleted[0]
+        return getattr(obj, attr)
+
+    if isinstance(obj, Employee):
+        return {f"employees:{_counter_status(value('status'))}": 1}
+    if isinstance(obj, Intern):
+        return {f"interns:{_counter_status(value('status'))}": 1}
+    if isinstance(obj, Document):
+        return {'documents': 1}
+    if isinstance(obj, InternDocument):
+        return {'intern_documents': 1}
+    if isinstance(obj, Payment):
+        status = _counter_status(value('status'))
+        return {
+            f'payments:{status}:count': 1,
+            f'payments:{status}:amount': value('amount') or 0,
+            f'payments:{status}:paid': value('paid_amt') or 0,
+        }
+    return {}
+
+def adjust_dashboard_counters(connection, deltas):
+    """Add `deltas` ({name: amount}) to the counters atomically, creating missing rows"""
+    table = DashboardCounter.__table__
+    now = datetime.now()
+    for name, delta in deltas.items():
+        if not delta:
+            continue
+        if connection.dialect.name == 'mysql':
+            from sqlalchemy.dialects.mysql import insert as upsert
+            statement = upsert(table).values(name=name, value=delta, updated_at=now)
+            statement = statement.on_duplicate_key_update(value=table.c.value + delta, updated_at=now)
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+            statement = upsert(table).values(name=name, value=delta, updated_at=now)
+            statement = statement.on_conflict_do_update(
+                index_elements=['name'], set_={'value': table.c.value + delta, 'updated_at': now}
+            )
+        connection.execute(statement)
+
+# Load the old value when these are set on an expired row, so the flush
+# listeners can move the row from its old counter to its new one
+for _attribute in (Employee.status, Intern.status, Payment.status, Payment.amount, Payment.paid_amt):
+    event.listen(_attribute, 'set', lambda target, value, oldvalue, initiator: None, active_history=True)
+
+def _add_contributions(deltas, contributions, sign):
+    for name, amount in contributions.items():
+        deltas[name] = deltas.get(name, 0) + sign * amount
+
+@event.listens_for(OrmSession, 'before_flush')
+def _counters_before_flush(session, flush_context, instances):
+    # Rows leaving a counter, read while deleted rows can still be loaded
+    deltas = session.info.setdefault('dashboard_counter_deltas', {})
+    for obj in session.deleted:
+        _add_contributions(deltas, _counter_contributions(obj, old=True), -1)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            _add_contributions(deltas, _counter_contributions(obj, old=True), -1)
+
+@event.listens_for(OrmSession, 'after_flush')
+def _counters_after_flush(session, flush_context):
+    # Rows entering a counter, read once INSERT defaults are populated
+    deltas = session.info.pop('dashboard_counter_deltas', {})
+    for obj in session.new:
+        _add_contributions(deltas, _counter_contributions(obj), 1)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            _add_contributions(deltas, _counter_contributions(obj), 1)
+
+    deltas = {name: delta for name, delta in deltas.items() if abs(delta) > 1e-9}
+    if deltas:
+        adjust_dashboard_counters(session.connection(), deltas)
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _counters_after_rollback(session, previous_transaction):
+    # A failed flush must not leave its deltas for the next one
+    session.info.pop('dashboard_counter_deltas', None)
+
+def rebuild_dashboard_counters():
+    """Recompute every counter from the source tables in one transaction"""
+    rows = {COUNTERS_BUILT: time.time()}
+    for model, prefix in ((Employee, 'employees'), (Intern, 'interns')):
+        for status, count in db.session.query(model.status, db.func.count(model.id)).group_by(model.status):
+            rows[f'{prefix}:{_counter_status(status)}'] = count
+    rows['documents'] = db.session.query(db.func.count(Document.id)).scalar()
+    rows['intern_documents'] = db.session.query(db.func.count(InternDocument.id)).scalar()
+    payment_rows = db.session.query(
+        Payment.status,
+        db.func.count(Payment.id),
+        db.func.coalesce(db.func.sum(Payment.amount), 0),
+        db.func.coalesce(db.func.sum(Payment.paid_amt), 0)
+    ).group_by(Payment.status)
+    for status, count, amount, paid in payment_rows:
+        status = _counter_status(status)
+        rows[f'payments:{status}:count'] = count
+        rows[f'payments:{status}:amount'] = amount
+        rows[f'payments:{status}:paid'] = paid
+
+    now = datetime.now()
+    with db.engine.begin() as conn:
+        conn.execute(db.delete(DashboardCounter.__table__))
+        conn.execute(db.insert(DashboardCounter.__table__),
+                     [{'name': name, 'value': value, 'updated_at': now} for name, value in rows.items()])
+    return rows
+
+_counter_rebuild = {'pid': None}
+_counter_rebuild_lock = threading.Lock()
+
+def _counter_rebuild_worker():
+    try:
+        with app.app_context():
+            rows = rebuild_dashboard_counters()
+        print(f"✅ Built {len(rows) - 1} dashboard counters")
+    except Exception as e:
+        print(f"⚠️ Dashboard counter rebuild failed: {e}")
+        with _counter_rebuild_lock:
+            _counter_rebuild['pid'] = None
+
+def start_dashboard_counter_rebuild():
+    """Build missing counters in a background thread, once per process"""
+    with _counter_rebuild_lock:
+        if _counter_rebuild['pid'] == os.getpid():
+            return
+        _counter_rebuild['pid'] = os.getpid()
+        threading.Thread(target=_counter_rebuild_worker, name='counter-rebuild', daemon=True).start()
+
+def dashboard_counters():
+    """
+    {name: value} for all counters. The migration seeds them; if they were
+    never built (e.g. tables made with db.create_all()) a background rebuild
+    is started and the request gets whatever is there for now.
+    """
+    counters = dict(db.session.query(DashboardCounter.name, DashboardCounter.value).all())
+    if COUNTERS_BUILT not in counters:
+        start_dashboard_counter_rebuild()
+    return counters
+
+def counted_statuses(counters, prefix):
+    """{status: count} for employees or interns from the counters"""
+    return {name.split(':', 1)[1]: int(round(value))
+            for name, value in counters.items() if name.startswith(prefix + ':')}
+
+def counted_payment_summary(counters):
+    """payment_summary() for all payments, read from the counters"""
+    summary = {
+        'count': 0,
+        'total_amount': 0,
+        'total_paid': 0,
+        'counts': dict.fromkeys(PAYMENT_STATUSES, 0),
+        'due': dict.fromkeys(PAYMENT_STATUSES, 0),
+    }
+    for name, value in counters.items():
+        if not name.startswith('payments:'):
+            continue
+        _, status, field = name.split(':')
+        if field == 'count':
+            summary['count'] += int(round(value))
+            summary['counts'][status] = summary['counts'].get(status, 0) + int(round(value))
+        elif field == 'amount':
+            summary['total_amount'] += value
+            summary['due'][status] = summary['due'].get(status, 0) + value
+        elif field == 'paid':
+            summary['total_paid'] += value
+            summary['due'][status] = summary['due'].get(status, 0) - value
+    summary['total_due'] = summary['total_amount'] - summary['total_paid']
+    return summary
+
+@app.cli.command('rebuild-dashboard-counters')
+def rebuild_dashboard_counters_command():
+    """Recompute the dashboard counters from the employee, intern, document and payment tables"""
+    rows = rebuild_dashboard_counters()
+    print(f"✅ Rebuilt {len(rows) - 1} dashboard counters")
+
+# ========== OVERDUE PAYMENTS ==========
+# Payment.status is the source of truth for list pages. Past-due payments are
+# flagged by one set-based UPDATE, run by `flask mark-overdue` (e.g. from cron)
+# and by a scheduler thread in every app process.
+app.config['OVERDUE_REFRESH_INTERVAL'] = int(os.getenv('OVERDUE_REFRESH_INTERVAL', 3600))  # seconds, 0 = off
+
+_overdue_scheduler = {'pid': None}
+_overdue_scheduler_lock = threading.Lock()
+
+def mark_overdue_payments(today=None):
+    """Mark unpaid payments past their due date Overdue and fill overdue_amount.
+    Returns the number of rows changed; rows already up to date are not touched."""
+    today = today or date.today()
+    outstanding = Payment.amount - Payment.paid_amt
+    stale = (
+        Payment.due_date < today,
+        Payment.paid_amt < Payment.amount,
+        db.or_(
+            Payment.status.is_(None),
+            Payment.status != 'Overdue',
+            Payment.overdue_amount.is_(None),
+            Payment.overdue_amount != outstanding,
+        ),
+    )
+    with db.engine.begin() as conn:
+        # What moves to Overdue, per current status, for the dashboard counters
+        moving = conn.execute(
+            db.select(
+                Payment.status,
+                db.func.count(Payment.id),
+                db.func.coalesce(db.func.sum(Payment.amount), 0),
+                db.func.coalesce(db.func.sum(Payment.paid_amt), 0)
+            )
+            .where(*stale, db.or_(Payment.status.is_(None), Payment.status != 'Overdue'))
+            .group_by(Payment.status)
+        ).all()
+        result = conn.execute(
+            db.update(Payment)
+            .where(*stale)
+            .values(status='Overdue', due_amount=outstanding, overdue_amount=outstanding)
+        )
+
+        deltas = {}
+        for status, count, amount, paid in moving:
+            for name, sign in ((_counter_status(status), -1), ('Overdue', 1)):
+                for field, value in (('count', count), ('amount', amount), ('paid', paid)):
+                    key = f'payments:{name}:{field}'
+                    deltas[key] = deltas.get(key, 0) + sign * value
+        adjust_dashboard_counters(conn, deltas)
+    return result.rowcount
+
+def _overdue_scheduler_loop():
+    while True:
+        try:
+            with app.app_context():
+                changed = mark_overdue_payments()
+            if changed:
+                print(f"🧾 Marked {changed} payments overdue")
+        except Exception as e:
+            print(f"⚠️ Overdue payment update failed: {e}")
+        time.sleep(app.config['OVERDUE_REFRESH_INTERVAL'])
+
+def start_overdue_scheduler():
+    """Start this process's overdue scheduler once; forked processes start their own"""
+    if app.config['OVERDUE_REFRESH_INTERVAL'] <= 0:
+        return
+    with _overdue_scheduler_lock:
+        if _overdue_scheduler['pid'] == os.getpid():
+            return
+        _overdue_scheduler['pid'] = os.getpid()
+        threading.Thread(target=_overdue_scheduler_loop, name='overdue-scheduler', daemon=True).start()
+
+@app.before_request
+def ensure_overdue_scheduler():
+    start_overdue_scheduler()
+
+@app.cli.command('mark-overdue')
+@click.option('--date', 'as_of', type=click.DateTime(formats=['%Y-%m-%d']), help='Treat this day as today')
+def mark_overdue_command(as_of):
+    """Mark unpaid payments past their due date as Overdue"""
+    changed = mark_overdue_payments(as_of.date() if as_of else None)
+    print(f"✅ Marked {changed} payments overdue")
+
+# ========== QUERY BUDGETS ==========
+# Every SQL statement is counted against the current app context. Requests to
+# endpoints listed in QUERY_BUDGETS log a warning when they go over, and
+# `flask check-query-budget` renders them and fails if any is over budget.
+app.config['QUERY_BUDGETS'] = {
+    'admin_dashboard': int(os.getenv('QUERY_BUDGET_ADMIN_DASHBOARD', 10)),
+}
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_sql_query(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+@app.after_request
+def report_query_count(response):
+    count = g.get('sql_query_count', 0)
+    response.headers['X-Query-Count'] = str(count)
+    budget = app.config['QUERY_BUDGETS'].get(request.endpoint)
+    if budget is not None and count > budget:
+        print(f"⚠️ {request.endpoint} ran {count} SQL queries (budget {budget})")
+    return response
+
+@app.cli.command('check-query-budget')
+def check_query_budget_command():
+    """Render each budgeted admin page against the current database and fail if it goes over budget"""
+    over = []
+    for endpoint, budget in app.config['QUERY_BUDGETS'].items():
+        with app.test_request_context():
+            path = url_for(endpoint)
+        with app.test_request_context(path):
+            session['is_admin'] = True
+            app.view_functions[endpoint]()
+            count = g.get('sql_query_count', 0)
+        status = '✅' if count <= budget else '❌'
+        print(f"{status} {endpoint}: {count} queries (budget {budget})")
+        if count > budget:
+            over.append(endpoint)
+    if over:
+        raise click.ClickException(f"Over query budget: {', '.join(over)}")
+
 #==================helper functions========================
 def get_company_domain(company):
     """Get company domain from company object"""
@@ -476,7 +1315,7 @@ def convert_dates(form_data):
 
 def get_watermark_logo(company_id):
     """Get watermark logo filename for a company"""
-    company = Company.query.get(company_id)
+    company = COMPANY_CACHE.get(company_id)
     if not company or not company.logo:
         return None
     return company.logo  # Just return the filename
@@ -603,20 +1442,6 @@ def calculate_due_amount(self):
         self.due_amount = self.amount - self.paid_amt
         return self.due_amount
 
-def update_status(self):
-        """Update payment status based on paid amount"""
-        if self.paid_amt >= self.amount:
-            self.status = 'Paid'
-        elif self.paid_amt > 0:
-            self.status = 'Partial'
-        else:
-            self.status = 'Pending'
-        
-        # Check for overdue
-        if self.due_date and datetime.now().date() > self.due_date and self.status != 'Paid':
-            self.status = 'Overdue'
-            self.overdue_amount = self.due_amount
-
 @app.template_filter('get')
 def get_filter(dictionary, key, default=''):
     """Safely get value from dictionary"""
@@ -626,15 +1451,299 @@ def get_filter(dictionary, key, default=''):
         return dictionary.get(key, default)
     return default
 
+# ========== COMPANY CACHE ==========
+class CompanyCache:
+    """
+    Process-wide, read-only copy of the company table. Companies change a few
+    times a year, so lookups are served from snapshots loaded in one query.
+    Once `ttl` seconds have passed, the next lookup reads the 'company' row of
+    cache_version and reloads only if another process bumped it. Writes in this
+    process bump that version and drop the copy immediately. Within a request
+    every lookup sees the same snapshot (kept on flask.g).
+    """
+
+    VERSION_NAME = 'company'
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.hits = 0
+        self.reloads = 0
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def _shared_version(self):
+        return db.session.query(CacheVersion.version).filter_by(name=self.VERSION_NAME).scalar() or 0
+
+    @staticmethod
+    def _load():
+        companies = [
+            SimpleNamespace(**{column.key: getattr(company, column.key) for column in Company.__table__.columns})
+            for company in Company.query.order_by(Company.id).all()
+        ]
+        return {'by_id': {company.id: company for company in companies}, 'all': companies}
+
+    def snapshot(self):
+        if has_app_context() and 'company_snapshot' in g:
+            return g.company_snapshot
+
+        now = time.monotonic()
+        with self._lock:
+            snapshot, version, checked_at = self._snapshot, self._version, self._checked_at
+        if snapshot is None or now - checked_at >= self.ttl:
+            # Read the version first: a write landing mid-load just means one more reload
+            current = self._shared_version()
+            if snapshot is None or current != version:
+                snapshot = self._load()
+                with self._lock:
+                    self.reloads += 1
+            with self._lock:
+                self._snapshot, self._version, self._checked_at = snapshot, current, now
+        else:
+            with self._lock:
+                self.hits += 1
+
+        if has_app_context():
+            g.company_snapshot = snapshot
+        return snapshot
+
+    def get(self, company_id):
+        """Company with this id (int or numeric string), or None"""
+        try:
+            company_id = int(company_id)
+        except (TypeError, ValueError):
+            return None
+        return self.snapshot()['by_id'].get(company_id)
+
+    def all(self):
+        return list(self.snapshot()['all'])
+
+    def invalidate(self):
+        """Drop this process's copy and bump the shared version so other workers reload"""
+        table = CacheVersion.__table__
+        with db.engine.begin() as conn:
+            bumped = conn.execute(
+                table.update()
+                .where(table.c.name == self.VERSION_NAME)
+                .values(version=table.c.version + 1, updated_at=datetime.now())
+            ).rowcount
+            if not bumped:
+                conn.execute(table.insert().values(name=self.VERSION_NAME, version=1, updated_at=datetime.now()))
+        with self._lock:
+            self._snapshot = None
+        if has_app_context():
+            g.pop('company_snapshot', None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'companies': len(self._snapshot['all']) if self._snapshot else 0,
+                'version': self._version,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'reloads': self.reloads
+            }
+
+COMPANY_CACHE = CompanyCache(ttl=int(os.getenv('COMPANY_CACHE_TTL', 60)))
+
+# ========== ASSET CACHE ==========
+class AssetCache:
+    """
+    Process-wide, size-bounded LRU cache for logo/signature files.
+    Entries are keyed by (path, mtime) so a replaced file is never served
+    stale, and hold both the raw bytes and the base64 data URI.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, path):
+        key = (path, os.path.getmtime(path))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        with open(path, 'rb') as f:
+            data = f.read()
+        entry = {'bytes': data, 'data_uri': None, 'size': len(data)}
+
+        with self._lock:
+            self.misses += 1
+            # Drop older versions of the same file
+            for old_key in [k for k in self._entries if k[0] == path]:
+                self.current_bytes -= self._entries.pop(old_key)['size']
+            self._entries[key] = entry
+            self.current_bytes += entry['size']
+            self._evict()
+        return entry
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, old = self._entries.popitem(last=False)
+            self.current_bytes -= old['size']
+
+    def get_bytes(self, path):
+        return self._load(path)['bytes']
+
+    def get_data_uri(self, path):
+        entry = self._load(path)
+        if entry['data_uri'] is None:
+            mime = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+            data_uri = f"data:{mime};base64,{base64.b64encode(entry['bytes']).decode('utf-8')}"
+            with self._lock:
+                entry['data_uri'] = data_uri
+                entry['size'] += len(data_uri)
+                self.current_bytes += len(data_uri)
+                self._evict()
+        return entry['data_uri']
+
+    def invalidate(self, path=None):
+        """Forget one file (all versions) or, with no path, everything"""
+        with self._lock:
+            for key in [k for k in self._entries if path is None or k[0] == path]:
+                self.current_bytes -= self._entries.pop(key)['size']
+
+    def merge_counts(self, hits, misses):
+        """Add lookups a render worker made against its own copy of the cache"""
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+ASSET_CACHE = AssetCache(max_bytes=int(os.getenv('ASSET_CACHE_MAX_BYTES', 32 * 1024 * 1024)))
+
+def save_company_upload(file, field):
+    """
+    Save an uploaded company logo/signature under static/images, drop it
+    from the asset cache and build its print variants.
+    """
+    filename = secure_filename(file.filename)
+    subfolders = PRINT_VARIANTS[COMPANY_ASSET_VARIANTS[field][0]]['folder']
+    path = os.path.join(app.root_path, 'static', 'images', *subfolders, filename)
+    file.save(path)
+    ASSET_CACHE.invalidate(path)
+    build_company_asset_variants(filename, field)
+    return filename
+
+# ========== PRINT ASSET VARIANTS ==========
+# Pixel box each variant is downscaled into: the printed size at 300 DPI for
+# logos and signatures (templates show them at most 200x100 CSS px), and
+# 150 DPI for the faint full-page watermark, which is also pre-faded so the
+# PDF does not need an opacity group.
+PRINT_VARIANTS = {
+    'logo': {'folder': (), 'box': (625, 313), 'dpi': 300},
+    'signature': {'folder': ('signatures',), 'box': (625, 313), 'dpi': 300},
+    'watermark': {'folder': (), 'box': (900, 900), 'dpi': 150, 'opacity': 0.1},
+}
+
+# Which variants each uploaded company field needs
+COMPANY_ASSET_VARIANTS = {
+    'logo': ('logo', 'watermark'),
+    'logo_with_name': ('logo',),
+    'signature': ('signature',),
+}
+
+def print_variant_relpath(filename, variant):
+    """
+    Path of a print variant relative to the static folder. The original
+    extension is kept (acme.jpg -> acme.jpg.png) so acme.jpg and acme.png
+    uploaded for logo and logo_with_name don't share a variant.
+    """
+    return f"images/print/{variant}/{filename}.png"
+
+def build_print_variant(filename, variant):
+    """Write a downscaled, palette-optimized PNG variant of a company image"""
+    spec = PRINT_VARIANTS[variant]
+    source = os.path.join(app.static_folder, 'images', *spec['folder'], filename)
+    target = os.path.join(app.static_folder, print_variant_relpath(filename, variant))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    with Image.open(source) as img:
+        img = img.convert('RGBA')
+        img.thumbnail(spec['box'], Image.LANCZOS)
+        if 'opacity' in spec:
+            img.putalpha(img.getchannel('A').point(lambda a: int(a * spec['opacity'])))
+        img = img.quantize(colors=256, method=Image.FASTOCTREE)
+        img.save(target, 'PNG', optimize=True, dpi=(spec['dpi'], spec['dpi']))
+
+    ASSET_CACHE.invalidate(target)
+    return target
+
+def build_company_asset_variants(filename, field):
+    """Build every print variant for an uploaded logo/signature, never failing the upload"""
+    for variant in COMPANY_ASSET_VARIANTS[field]:
+        try:
+            target = build_print_variant(filename, variant)
+            print(f"✅ Built {variant} variant: {target} ({os.path.getsize(target)/1024:.1f}KB)")
+        except Exception as e:
+            print(f"⚠️ Could not build {variant} variant for {filename}: {e}")
+
+def remove_company_asset_variants(filename, field):
+    for variant in COMPANY_ASSET_VARIANTS[field]:
+        path = os.path.join(app.static_folder, print_variant_relpath(filename, variant))
+        if os.path.exists(path):
+            os.remove(path)
+            ASSET_CACHE.invalidate(path)
+
+def remove_replaced_company_asset_variants(filename, field):
+    """Remove the print variants of a replaced upload that no company uses any more"""
+    for variant in COMPANY_ASSET_VARIANTS[field]:
+        fields = [name for name, variants in COMPANY_ASSET_VARIANTS.items() if variant in variants]
+        in_use = db.session.query(Company.id).filter(
+            db.or_(*[getattr(Company, name) == filename for name in fields])
+        ).first()
+        path = os.path.join(app.static_folder, print_variant_relpath(filename, variant))
+        if not in_use and os.path.exists(path):
+            os.remove(path)
+            ASSET_CACHE.invalidate(path)
+
+def has_print_asset(filename, variant):
+    return bool(filename) and os.path.exists(
+        os.path.join(app.static_folder, print_variant_relpath(filename, variant))
+    )
+
+@app.template_global()
+def print_asset_url(filename, variant):
+    """URL of the print variant of a company image, or of the original if none was built"""
+    if has_print_asset(filename, variant):
+        relpath = print_variant_relpath(filename, variant)
+    else:
+        relpath = '/'.join(('images',) + PRINT_VARIANTS[variant]['folder'] + (filename,))
+    return url_for('static', filename=relpath, _external=True)
+
+app.jinja_env.globals['has_print_asset'] = has_print_asset
+
+@app.cli.command('build-print-assets')
+def build_print_assets_command():
+    """Build print variants for every company's existing logos and signatures"""
+    for company in Company.query.all():
+        for field in COMPANY_ASSET_VARIANTS:
+            filename = getattr(company, field)
+            if filename:
+                build_company_asset_variants(filename, field)
+
 #production function
-def embed_images_as_base64(html_content):
-    """Convert only small images to base64, skip large ones"""
-    static_folder = app.static_folder
-    images_folder = os.path.join(static_folder, 'images')
-    signatures_folder = os.path.join(images_folder, 'signatures')
-    
-    image_cache = {}
-    MAX_IMAGE_SIZE = 500 * 1024  # 500KB - skip images larger than this
+def embed_images_as_base64(html_content, local_hosts=()):
+    """Inline our own small images as base64 data URIs, skip large ones"""
+    MAX_IMAGE_SIZE = 500 * 1024  # 500KB - larger images go through the url_fetcher
     
     def replace_image(match):
         img_tag = match.group(0)
@@ -644,60 +1753,512 @@ def embed_images_as_base64(html_content):
         
         src = src_match.group(1)
         
-        # Skip external URLs and data URIs
-        if src.startswith('data:') or src.startswith('http://') or src.startswith('https://'):
+        # Skip data URIs and anything that is not one of our assets
+        if src.startswith('data:'):
             return img_tag
         
-        if src in image_cache:
-            return img_tag.replace(src, image_cache[src])
-        
-        abs_path = None
-        
-        if src.startswith('/static/'):
-            relative_path = src.replace('/static/', '')
-            abs_path = os.path.join(static_folder, relative_path)
-        elif 'signatures' in src:
-            filename = src.split('signatures/')[-1]
-            abs_path = os.path.join(signatures_folder, filename)
-        elif 'images' in src:
-            filename = src.split('images/')[-1]
-            abs_path = os.path.join(images_folder, filename)
-        else:
+        abs_path = resolve_local_asset(src, local_hosts)
+        if not abs_path or not os.path.isfile(abs_path):
             return img_tag
         
-        if abs_path and os.path.exists(abs_path):
-            # Check file size - skip if too large
-            file_size = os.path.getsize(abs_path)
-            if file_size > MAX_IMAGE_SIZE:
-                print(f"⚠️ Skipping large image ({file_size/1024:.1f}KB): {src}")
-                return img_tag
-            
-            try:
-                with open(abs_path, 'rb') as f:
-                    image_data = base64.b64encode(f.read()).decode('utf-8')
-                
-                ext = abs_path.split('.')[-1].lower()
-                if ext in ['jpg', 'jpeg']:
-                    mime = 'image/jpeg'
-                elif ext == 'png':
-                    mime = 'image/png'
-                else:
-                    mime = f'image/{ext}'
-                
-                new_src = f'data:{mime};base64,{image_data}'
-                image_cache[src] = new_src
-                print(f"✅ Embedded image: {src} ({file_size/1024:.1f}KB)")
-                return img_tag.replace(src, new_src)
-            except Exception as e:
-                print(f"⚠️ Failed to embed {src}: {e}")
-                return img_tag
+        if os.path.getsize(abs_path) > MAX_IMAGE_SIZE:
+            return img_tag
         
-        return img_tag
+        try:
+            return img_tag.replace(src, ASSET_CACHE.get_data_uri(abs_path))
+        except Exception as e:
+            print(f"⚠️ Failed to embed {src}: {e}")
+            return img_tag
     
-    html_content = re.sub(r'<img[^>]+>', replace_image, html_content)
-    return html_content
+    return re.sub(r'<img[^>]+>', replace_image, html_content)
+
+# Counters for assets WeasyPrint pulled while rendering documents
+PDF_FETCH_STATS = {'local': 0, 'remote': 0, 'missing': 0}
+_pdf_fetch_stats_lock = threading.Lock()
+
+def _count_pdf_fetch(kind):
+    with _pdf_fetch_stats_lock:
+        PDF_FETCH_STATS[kind] += 1
+
+def _merge_pdf_fetch_stats(counts):
+    """Add fetch counts reported back by a render worker"""
+    with _pdf_fetch_stats_lock:
+        for kind, count in counts.items():
+            PDF_FETCH_STATS[kind] += count
+
+def resolve_local_asset(url, local_hosts=()):
+    """
+    Map a /static/... or /profiles/... URL to a file on disk.
+    Returns None for URLs that point somewhere other than this app.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('', 'http', 'https'):
+        return None
+    if parsed.netloc and parsed.netloc not in local_hosts:
+        return None
+
+    path = unquote(parsed.path)
+    static_prefix = app.static_url_path.rstrip('/') + '/'
+    if path.startswith(static_prefix):
+        return safe_join(app.static_folder, path[len(static_prefix):])
+    if path.startswith('/profiles/'):
+        profiles_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'profiles')
+        return safe_join(profiles_dir, path[len('/profiles/'):])
+    return None
+
+def make_pdf_url_fetcher(local_hosts=()):
+    """
+    Build a WeasyPrint url_fetcher that reads our own static files and
+    profile images from disk instead of requesting them over HTTP from the
+    worker that is busy rendering. Anything else goes to the default fetcher.
+    """
+    local_hosts = tuple(local_hosts) + ('localhost', '127.0.0.1')
+
+    def fetcher(url):
+        if url.startswith('data:'):
+            return default_url_fetcher(url)
+
+        abs_path = resolve_local_asset(url, local_hosts)
+        if abs_path:
+            if os.path.isfile(abs_path):
+                _count_pdf_fetch('local')
+                return {
+                    'string': ASSET_CACHE.get_bytes(abs_path),
+                    'mime_type': mimetypes.guess_type(abs_path)[0],
+                    'redirected_url': url
+                }
+            _count_pdf_fetch('missing')
+            raise FileNotFoundError(f"Asset not found on disk: {url}")
+
+        _count_pdf_fetch('remote')
+        return default_url_fetcher(url)
+
+    return fetcher
+
+def get_pdf_local_hosts():
+    """Hosts whose /static and /profiles URLs are served from disk"""
+    hosts = list(app.config.get('PDF_LOCAL_HOSTS', []))
+    if has_request_context():
+        hosts.append(request.host)
+    base_url = app.config.get('PDF_BASE_URL')
+    if base_url:
+        hosts.append(urlparse(base_url).netloc)
+    return hosts
+
+def get_pdf_base_url():
+    """Base URL WeasyPrint uses to resolve relative links in documents"""
+    if app.config.get('PDF_BASE_URL'):
+        return app.config['PDF_BASE_URL']
+    if has_request_context():
+        return request.url_root
+    return app.root_path + os.sep
+
+# ========== PDF RENDER POOL ==========
+# WeasyPrint layout is CPU bound and leaks memory, so documents are laid out
+# in a small pool of pre-warmed worker processes that are recycled after a
+# fixed number of renders. PDF_RENDER_WORKERS=0 renders inline instead.
+app.config['PDF_RENDER_WORKERS'] = int(os.getenv('PDF_RENDER_WORKERS', 2))
+app.config['PDF_RENDER_MAX_JOBS_PER_WORKER'] = int(os.getenv('PDF_RENDER_MAX_JOBS_PER_WORKER', 50))
+app.config['PDF_RENDER_TIMEOUT'] = int(os.getenv('PDF_RENDER_TIMEOUT', 60))
+app.config['PDF_RENDER_QUEUE_SIZE'] = int(os.getenv('PDF_RENDER_QUEUE_SIZE', 8))
+app.config['PDF_RENDER_QUEUE_WAIT'] = int(os.getenv('PDF_RENDER_QUEUE_WAIT', 5))
+# Forking a multithreaded server can copy held locks into the workers, so start them from a clean process
+app.config['PDF_RENDER_START_METHOD'] = os.getenv('PDF_RENDER_START_METHOD', 'forkserver')
+
+class RenderPoolBusy(Exception):
+    """Raised when the render queue is full"""
+
+class RenderTimeout(Exception):
+    """Raised when a render job runs past PDF_RENDER_TIMEOUT"""
+
+PDF_POOL_STATS = {'submitted': 0, 'completed': 0, 'failed': 0, 'timeouts': 0, 'rejected': 0}
+_pdf_pool_stats_lock = threading.Lock()
+_pdf_pool = None
+_pdf_pool_pid = None
+_pdf_pool_lock = threading.Lock()
+_pdf_pool_slots = threading.BoundedSemaphore(app.config['PDF_RENDER_QUEUE_SIZE'])
+_worker_font_config = None
+
+def _record_pdf_pool(key):
+    with _pdf_pool_stats_lock:
+        PDF_POOL_STATS[key] += 1
+
+def _write_pdf(html_content, target, base_url, local_hosts):
+    """
+    Lay out an HTML string and write the PDF (runs inline or in a pool worker).
+    Small images are expected to be inlined already by the caller.
+    """
+    if HTML is None:
+        raise ImportError("WeasyPrint is not installed")
+
+    document = HTML(
+        string=html_content,
+        base_url=base_url,
+        url_fetcher=make_pdf_url_fetcher(local_hosts)
+    )
+    return document.write_pdf(target, font_config=_worker_font_config)
+
+def _render_worker_init():
+    """Pre-warm a render worker: import WeasyPrint and load fonts once"""
+    global _worker_font_config
+    if HTML is None:
+        return
+    from weasyprint.fonts import FontConfiguration
+    _worker_font_config = FontConfiguration()
+    HTML(string='<p>warm-up</p>').write_pdf(font_config=_worker_font_config)
+
+def _render_pdf_job(html_content, output_path, base_url, local_hosts):
+    """Pool job: write to output_path, or return the PDF bytes when it is None"""
+    return _write_pdf(html_content, output_path, base_url, local_hosts)
+
+def _write_pdf_sections(html_content, sections, combined_path, base_url, local_hosts):
+    """
+    Lay out a multi-section document once and split it into one PDF per
+    section. sections is a list of (anchor_id, output_path); a section runs
+    from the page holding its anchor up to the next section's first page.
+    Returns {anchor_id: page_count}, 0 for anchors that were not found.
+    Like _write_pdf, small images must already be inlined.
+    """
+    if HTML is None:
+        raise ImportError("WeasyPrint is not installed")
+
+    document = HTML(
+        string=html_content,
+        base_url=base_url,
+        url_fetcher=make_pdf_url_fetcher(local_hosts)
+    ).render(font_config=_worker_font_config)
+
+    first_page = {}
+    for index, page in enumerate(document.pages):
+        for anchor in page.anchors:
+            first_page.setdefault(anchor, index)
+
+    found = sorted((first_page[anchor], anchor, path) for anchor, path in sections if anchor in first_page)
+    page_counts = {anchor: 0 for anchor, _ in sections}
+    for i, (start, anchor, path) in enumerate(found):
+        end = found[i + 1][0] if i + 1 < len(found) else len(document.pages)
+        document.copy(document.pages[start:end]).write_pdf(path)
+        page_counts[anchor] = end - start
+
+    if combined_path:
+        document.write_pdf(combined_path)
+    return page_counts
+
+def get_pdf_pool():
+    """Return this process's render pool, creating it on first use"""
+    global _pdf_pool, _pdf_pool_pid
+    if app.config['PDF_RENDER_WORKERS'] <= 0:
+        return None
+
+    with _pdf_pool_lock:
+        # Each gunicorn worker gets its own pool; never reuse one inherited via fork
+        if _pdf_pool is None or _pdf_pool_pid != os.getpid():
+            context = multiprocessing.get_context(app.config['PDF_RENDER_START_METHOD'])
+            _pdf_pool = context.Pool(
+                processes=app.config['PDF_RENDER_WORKERS'],
+                initializer=_render_worker_init,
+                maxtasksperchild=app.config['PDF_RENDER_MAX_JOBS_PER_WORKER']
+            )
+            _pdf_pool_pid = os.getpid()
+            print(f"✅ PDF render pool started with {app.config['PDF_RENDER_WORKERS']} workers")
+        return _pdf_pool
 
-def html_to_pdf(html_content, output_path):
+def _reset_pdf_pool(pool):
+    """
+    Retire a pool with a hung render. The next job starts a fresh pool; the
+    old one takes no new work and is terminated after PDF_RENDER_TIMEOUT,
+    which lets its other in-flight renders finish or time out first.
+    """
+    global _pdf_pool
+    with _pdf_pool_lock:
+        # Another timed-out job may already have replaced it
+        if pool is not _pdf_pool:
+            return
+        _pdf_pool = None
+
+    pool.close()
+    reaper = threading.Timer(app.config['PDF_RENDER_TIMEOUT'], pool.terminate)
+    reaper.daemon = True
+    reaper.start()
+
+@atexit.register
+def _shutdown_pdf_pool():
+    if _pdf_pool is not None and _pdf_pool_pid == os.getpid():
+        _pdf_pool.terminate()
+
+def submit_pdf_render(html_content, output_path=None, base_url=None, local_hosts=()):
+    """Render one document in the pool and wait for it"""
+    # Inline images here so the asset cache lives in this process, not in short-lived workers
+    html_content = embed_images_as_base64(html_content, local_hosts)
+    return run_render_job(_render_pdf_job, html_content, output_path, base_url, list(local_hosts))
+
+def _counted_render_job(job_func, args):
+    """
+    Pool wrapper: run job_func and return its result together with the
+    fetch and asset cache counts it added in this worker, so the parent's
+    /admin/render-stats includes them.
+    """
+    fetches_before = dict(PDF_FETCH_STATS)
+    hits_before, misses_before = ASSET_CACHE.hits, ASSET_CACHE.misses
+    result = job_func(*args)
+    fetches = {kind: PDF_FETCH_STATS[kind] - fetches_before[kind] for kind in PDF_FETCH_STATS}
+    return result, fetches, (ASSET_CACHE.hits - hits_before, ASSET_CACHE.misses - misses_before)
+
+def run_render_job(job_func, *args):
+    """
+    Run a render job in the pool and wait for it.
+    Raises RenderPoolBusy when the queue stays full and RenderTimeout when
+    the job does not finish within PDF_RENDER_TIMEOUT.
+    """
+    pool = get_pdf_pool()
+    if pool is None:
+        return job_func(*args)
+
+    if not _pdf_pool_slots.acquire(timeout=app.config['PDF_RENDER_QUEUE_WAIT']):
+        _record_pdf_pool('rejected')
+        raise RenderPoolBusy("PDF render queue is full, try again shortly")
+
+    try:
+        _record_pdf_pool('submitted')
+        job = pool.apply_async(_counted_render_job, (job_func, args))
+        try:
+            result, fetches, (hits, misses) = job.get(timeout=app.config['PDF_RENDER_TIMEOUT'])
+        except multiprocessing.TimeoutError:
+            _record_pdf_pool('timeouts')
+            _reset_pdf_pool(pool)
+            raise RenderTimeout(f"PDF render exceeded {app.config['PDF_RENDER_TIMEOUT']}s")
+        except Exception:
+            _record_pdf_pool('failed')
+            raise
+        _record_pdf_pool('completed')
+        _merge_pdf_fetch_stats(fetches)
+        ASSET_CACHE.merge_counts(hits, misses)
+        return result
+    finally:
+        _pdf_pool_slots.release()
+
+# ========== PDF OUTPUT CACHE ==========
+class PdfOutputCache:
+    """
+    Content-addressed cache of rendered PDFs on the filesystem, so every
+    gunicorn worker shares it. Keys are a hash of the final HTML plus the
+    mtime/size of each local asset it references. Total size is bounded
+    by max_bytes; least recently used files (by mtime, refreshed on every
+    hit) are evicted first.
+
+    Puts don't scan the folder: each process adds what it wrote to the total
+    of its last scan, and only rescans and evicts when that estimate passes
+    max_bytes or it has written RESCAN_FRACTION of max_bytes since (other
+    processes write to the same folder). Eviction goes down to
+    EVICT_TO_FRACTION so the next scan is some way off.
+    """
+    RESCAN_FRACTION = 0.1
+    EVICT_TO_FRACTION = 0.9
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._scanned_bytes = None
+        self._added_bytes = 0
+        self._lock = threading.Lock()
+        self._evict_lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key_for(self, html_content, local_hosts=()):
+        digest = hashlib.sha256(html_content.encode('utf-8'))
+        for src in sorted(set(re.findall(r'src=["\']([^"\']+)["\']', html_content))):
+            abs_path = resolve_local_asset(src, local_hosts)
+            if abs_path and os.path.isfile(abs_path):
+                stat = os.stat(abs_path)
+                digest.update(f"|{abs_path}:{stat.st_mtime_ns}:{stat.st_size}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _path(self, key, name):
+        return os.path.join(self.folder, f"{key}.{name}")
+
+    def get(self, key, name='pdf'):
+        """Path of a cached entry, or None; a hit marks it recently used"""
+        path = self._path(key, name)
+        try:
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def put_bytes(self, key, data, name='pdf'):
+        path = self._path(key, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        self._store(tmp_path, path)
+
+    def put_file(self, key, src_path, name='pdf'):
+        path = self._path(key, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(src_path, tmp_path)
+        self._store(tmp_path, path)
+
+    def _store(self, tmp_path, path):
+        """Move a written temp file into place and evict if the size estimate says so"""
+        size = os.path.getsize(tmp_path)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._added_bytes += size - replaced
+            if (self._scanned_bytes is not None
+                    and self._scanned_bytes + self._added_bytes <= self.max_bytes
+                    and self._added_bytes <= self.max_bytes * self.RESCAN_FRACTION):
+                return
+            self._added_bytes = 0
+
+        with self._evict_lock:
+            total = self._evict()
+        with self._lock:
+            self._scanned_bytes = total
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.folder) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        """Scan the folder, evict down to EVICT_TO_FRACTION if over max_bytes; returns the bytes left"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return total
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes * self.EVICT_TO_FRACTION:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        return total
+
+    def stats(self):
+        entries = self._entries()
+        with self._lock:
+            return {
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+app.config['PDF_CACHE_FOLDER'] = os.getenv('PDF_CACHE_FOLDER', os.path.join(app.config['UPLOAD_FOLDER'], '.pdf_cache'))
+app.config['PDF_CACHE_MAX_BYTES'] = int(os.getenv('PDF_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+PDF_CACHE = PdfOutputCache(app.config['PDF_CACHE_FOLDER'], app.config['PDF_CACHE_MAX_BYTES'])
+
+def render_pdf(html_content, target=None, base_url=None):
+    """
+    Render an HTML string straight to PDF, without a temp HTML file.
+    Returns the PDF bytes when no target is given, otherwise writes to
+    target (a filesystem path or a writable file-like object).
+    Identical HTML with unchanged assets is served from PDF_CACHE.
+    """
+    base_url = base_url or get_pdf_base_url()
+    local_hosts = get_pdf_local_hosts()
+    to_path = target is None or isinstance(target, (str, os.PathLike))
+
+    cache_key = PDF_CACHE.key_for(html_content, local_hosts) if PDF_CACHE.enabled else None
+    cached_path = cache_key and PDF_CACHE.get(cache_key)
+    if cached_path:
+        print(f"♻️ PDF cache hit: {cache_key[:12]}")
+        if target is not None and to_path:
+            shutil.copyfile(cached_path, target)
+            return None
+        with open(cached_path, 'rb') as f:
+            data = f.read()
+        if target is None:
+            return data
+        target.write(data)
+        return None
+
+    if to_path:
+        result = submit_pdf_render(html_content, target and os.fspath(target), base_url, local_hosts)
+    else:
+        result = submit_pdf_render(html_content, None, base_url, local_hosts)
+        target.write(result)
+
+    if cache_key:
+        try:
+            if result is None:
+                PDF_CACHE.put_file(cache_key, target)
+            else:
+                PDF_CACHE.put_bytes(cache_key, result)
+        except OSError as e:
+            print(f"⚠️ Could not store PDF in cache: {e}")
+
+    return result if target is None else None
+
+def render_pdf_sections(html_content, sections, combined_path=None, base_url=None, local_hosts=None):
+    """
+    Render a multi-section document in a single layout pass and write one
+    PDF per (anchor_id, output_path) section, plus an optional combined PDF.
+    Returns {anchor_id: page_count}. Cached like render_pdf. Pass base_url and
+    local_hosts when calling outside a request (e.g. from pipeline threads).
+    """
+    base_url = base_url or get_pdf_base_url()
+    if local_hosts is None:
+        local_hosts = get_pdf_local_hosts()
+    sections = list(sections)
+
+    cache_key = PDF_CACHE.key_for(html_content, local_hosts) if PDF_CACHE.enabled else None
+    if cache_key:
+        manifest_path = PDF_CACHE.get(cache_key, 'sections.json')
+        if manifest_path:
+            with open(manifest_path) as f:
+                page_counts = json.load(f)
+            wanted = [(anchor, path) for anchor, path in sections if page_counts.get(anchor)]
+            cached = [(PDF_CACHE.get(cache_key, f"{anchor}.pdf"), path) for anchor, path in wanted]
+            if combined_path:
+                cached.append((PDF_CACHE.get(cache_key), combined_path))
+            if all(src for src, _ in cached):
+                print(f"♻️ PDF cache hit: {cache_key[:12]} ({len(cached)} files)")
+                for src, dest in cached:
+                    shutil.copyfile(src, dest)
+                return {anchor: page_counts.get(anchor, 0) for anchor, _ in sections}
+
+    page_counts = run_render_job(
+        _write_pdf_sections, embed_images_as_base64(html_content, local_hosts),
+        sections, combined_path, base_url, local_hosts
+    )
+
+    if cache_key:
+        try:
+            for anchor, path in sections:
+                if page_counts.get(anchor):
+                    PDF_CACHE.put_file(cache_key, path, f"{anchor}.pdf")
+            if combined_path:
+                PDF_CACHE.put_file(cache_key, combined_path)
+            PDF_CACHE.put_bytes(cache_key, json.dumps(page_counts).encode('utf-8'), 'sections.json')
+        except OSError as e:
+            print(f"⚠️ Could not store PDFs in cache: {e}")
+
+    return page_counts
+
+def html_to_pdf(html_content, output_path, base_url=None):
     """Convert HTML to PDF with detailed logging"""
     print("="*60)
     print("🔴 HTML_TO_PDF CALLED")
@@ -706,28 +2267,12 @@ def html_to_pdf(html_content, output_path):
     print("="*60)
     
     try:
-        from weasyprint import HTML
-        import tempfile
-        import os
-        
-        # Create temp HTML file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as f:
-            f.write(html_content)
-            temp_html = f.name
-        
-        print(f"📄 Temp HTML created: {temp_html}")
-        
-        # SIMPLE CONVERSION - NO EXTRA PARAMETERS
-        HTML(filename=temp_html).write_pdf(output_path)
-        
-        # Clean up
-        if os.path.exists(temp_html):
-            os.unlink(temp_html)
-            print(f"🧹 Temp file cleaned: {temp_html}")
+        render_pdf(html_content, output_path, base_url=base_url)
         
         print(f"✅ PDF GENERATED SUCCESSFULLY: {output_path}")
         if os.path.exists(output_path):
             print(f"📁 PDF size: {os.path.getsize(output_path)} bytes")
+        print(f"🖼️ Asset fetches so far: {PDF_FETCH_STATS}")
         
         return True
         
@@ -741,6 +2286,56 @@ def html_to_pdf(html_content, output_path):
         traceback.print_exc()
         return False
 
+# ========== RENDER PIPELINE ==========
+# Rendering is CPU-bound, so a run's batches are laid out in parallel, one per
+# render worker. Drive uploads are queued separately in the Drive outbox.
+def split_batches(items, parts):
+    """Split items into at most `parts` contiguous batches of near-equal size"""
+    items = list(items)
+    parts = max(1, min(parts, len(items)))
+    size, extra = divmod(len(items), parts)
+    batches, start = [], 0
+    for i in range(parts):
+        end = start + size + (1 if i < extra else 0)
+        batches.append(items[start:end])
+        start = end
+    return [batch for batch in batches if batch]
+
+def render_pipeline(batches, progress=None):
+    """
+    Render (html, [(anchor_id, output_path), ...]) batches with render_pdf_sections,
+    running as many batches at once as there are render workers.
+    Returns {output_path: {'pages': n}}, 0 pages for files that failed.
+    """
+    base_url = get_pdf_base_url()
+    local_hosts = get_pdf_local_hosts()
+    batches = list(batches)
+    total = sum(len(sections) for _, sections in batches)
+    outcomes = {}
+    report = progress or (lambda done, total, message=None: None)
+
+    render_workers = max(1, min(len(batches), app.config['PDF_RENDER_WORKERS']))
+    started = time.time()
+    with ThreadPoolExecutor(render_workers, thread_name_prefix='pdf-render') as renders:
+        render_futures = {
+            renders.submit(render_pdf_sections, html, sections, None, base_url, local_hosts): sections
+            for html, sections in batches
+        }
+        for future in as_completed(render_futures):
+            sections = render_futures[future]
+            try:
+                page_counts = future.result()
+            except Exception as e:
+                print(f"❌ Render batch failed: {e}")
+                traceback.print_exc()
+                page_counts = {}
+            for anchor, path in sections:
+                outcomes[path] = {'pages': page_counts.get(anchor, 0)}
+            report(len(outcomes), total, f"Rendered {len(sections)} file(s)")
+
+    print(f"✅ Pipeline: {total} files in {len(batches)} batches, {time.time() - started:.1f}s")
+    return outcomes
+
 #test route
 @app.route('/test-pdf-generation')
 def test_pdf_generation():
@@ -777,6 +2372,44 @@ def test_pdf_generation():
         import traceback
         return f"Error: {str(e)}<br><pre>{traceback.format_exc()}</pre>", 500
 
+@app.route('/admin/render-stats')
+def render_stats():
+    """PDF rendering and Drive client counters (JSON)"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify({
+        'asset_fetches': dict(PDF_FETCH_STATS),
+        'asset_cache': ASSET_CACHE.stats(),
+        'render_pool': dict(PDF_POOL_STATS, workers=app.config['PDF_RENDER_WORKERS']),
+        'pdf_cache': PDF_CACHE.stats(),
+        'company_cache': COMPANY_CACHE.stats(),
+        'drive_client': DRIVE_CLIENT.stats()
+    })
+
+
+def db_pool_stats():
+    """Connection pool checkout counters plus the pool's current occupancy"""
+    with _db_pool_stats_lock:
+        stats = dict(DB_POOL_STATS)
+    stats['wait_avg_ms'] = round(stats['wait_total_ms'] / stats['checkouts'], 3) if stats['checkouts'] else 0.0
+    stats['wait_total_ms'] = round(stats['wait_total_ms'], 3)
+    stats['wait_max_ms'] = round(stats['wait_max_ms'], 3)
+    pool = db.engine.pool
+    stats['backend'] = db.engine.dialect.name
+    stats['pool_class'] = type(pool).__name__
+    if isinstance(pool, QueuePool):
+        stats.update(pool_size=pool.size(), checked_out=pool.checkedout(),
+                     overflow=max(pool.overflow(), 0), max_overflow=app.config['DB_MAX_OVERFLOW'])
+    return stats
+
+
+@app.route('/admin/db-stats')
+def db_stats():
+    """Database connection pool metrics (JSON)"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    return jsonify(db_pool_stats())
+
 ##local function
 # def html_to_pdf(html_content, output_path):
 #     # Path to the standalone WeasyPrint executable (for local Windows)
@@ -875,7 +2508,7 @@ def preview():
         company = None
         if company_id:
             try:
-                company = Company.query.get(int(company_id))
+                company = COMPANY_CACHE.get(int(company_id))
             except (ValueError, TypeError):
                 company = None
         
@@ -972,7 +2605,7 @@ def preview():
             company = None
             if company_id:
                 try:
-                    company = Company.query.get(int(company_id))
+                    company = COMPANY_CACHE.get(int(company_id))
                 except (ValueError, TypeError):
                     company = None
             
@@ -1041,7 +2674,7 @@ def preview():
             session['intern_preview_data'] = data
         
         # Get company for watermark
-        company = Company.query.get(form_data.get('company')) if form_data.get('company') else None
+        company = COMPANY_CACHE.get(form_data.get('company')) if form_data.get('company') else None
         
         return render_template(
             f'documents/{form_data.get("document_type")}.html',
@@ -1060,7 +2693,7 @@ def preview():
     company_id = form_data.get('company')
     if company_id:
         try:
-            company = Company.query.get(int(company_id))
+            company = COMPANY_CACHE.get(int(company_id))
         except (ValueError, TypeError):
             company = None
     else:
@@ -1287,7 +2920,7 @@ def preview_document(doc_type):
         company = None
         if company_id:
             try:
-                company = Company.query.get(int(company_id))
+                company = COMPANY_CACHE.get(int(company_id))
             except (ValueError, TypeError):
                 company = None
         
@@ -1381,7 +3014,7 @@ def preview_document(doc_type):
             company = None
             if company_id:
                 try:
-                    company = Company.query.get(int(company_id))
+                    company = COMPANY_CACHE.get(int(company_id))
                 except (ValueError, TypeError):
                     company = None
             
@@ -1460,7 +3093,7 @@ def preview_document(doc_type):
         company_id = form_data.get('company')
         if company_id:
             try:
-                company = Company.query.get(int(company_id))
+                company = COMPANY_CACHE.get(int(company_id))
             except (ValueError, TypeError):
                 company = None
         
@@ -1485,7 +3118,7 @@ def preview_document(doc_type):
     company_id = form_data.get('company')
     if company_id:
         try:
-            company = Company.query.get(int(company_id))
+            company = COMPANY_CACHE.get(int(company_id))
         except (ValueError, TypeError):
             company = None
     else:
@@ -1581,17 +3214,65 @@ def preview_document(doc_type):
         watermark_logo=watermark_logo
     )
 
-@app.route('/generate', methods=['POST'])
-def generate():
-    form_data = session.get('form_data')
-    selected_months = session.get('selected_months', [])
-    member_type = session.get('member_type', 'employee')
-
-    if not form_data:
-        return redirect(url_for('index'))
+def build_salary_slip(form_data, company, month, year, paid_days=30, month_days=30, worked_days=30, lop=0):
+    """Template data for one month of documents/salary_slip.html"""
+    ctc = float(form_data.get('ctc') or 0)
+    increment_per_month = float(form_data.get('increment_per_month') or 0)
+    components = calculate_salary_components(
+        ctc=ctc,
+        increment_per_month=increment_per_month,
+        paid_days=paid_days,
+        month_days=month_days
+    )
+    return {
+        'employee_id': form_data.get('employee_id'),
+        'company': company.id,
+        'document_type': 'salary_slip',
+        'full_name': form_data.get('full_name'),
+        'address': form_data.get('address'),
+        'aadhar_no': form_data.get('aadhar_no'),
+        'pan_no': form_data.get('pan_no'),
+        'designation': form_data.get('designation'),
+        'gender': form_data.get('gender'),
+        'department': form_data.get('department'),
+        'ctc': ctc,
+        'increment_per_month': increment_per_month,
+        'month': month,
+        'year': year,
+        'basic': components['basic'],
+        'hra': components['hra'],
+        'conveyance': components['conveyance'],
+        'medical': components['medical'],
+        'telephone': components['telephone'],
+        'special_allowance': components['special_allowance'],
+        'gross_earnings': components['gross_earnings'],
+        'professional_tax': components['professional_tax'],
+        'pf_amount': components['pf_amount'],
+        'income_tax': components['income_tax'],
+        'gross_deductions': components['gross_deductions'],
+        'net_salary': components['net_salary'],
+        'words': num2words(int(components['net_salary']), lang='en_IN').title() + ' Rupees',
+        'worked_days': worked_days,
+        'lop': lop,
+        'paid_days': paid_days,
+        'month_days': month_days,
+        'joining_date': form_data.get('joining_date'),
+        'resignation_date': form_data.get('resignation_date'),
+        'bank_details': form_data.get('bank_details', {})
+    }
 
-    upload_to_drive_flag = request.form.get('upload_to_drive') == 'true'
+def run_generation(payload, progress=None):
+    """
+    Generate the documents described by a /generate payload (see generation_payload).
+    Runs inside a request context, either inline or on a job worker, and returns
+    a generation_result() dict instead of flashing and redirecting.
+    """
+    form_data = dict(payload['form_data'])
+    selected_months = payload.get('selected_months') or []
+    admin_username = payload.get('admin_username')
+    upload_to_drive_flag = bool(payload.get('upload_to_drive'))
     doc_type = form_data.get('document_type')
+    report = progress or (lambda done, total, message=None: None)
 
     form_data = convert_dates(form_data)
 
@@ -1603,30 +3284,26 @@ def generate():
             employee = Employee.query.filter_by(employee_id=form_data.get('employee_id')).first()
         
         if not employee:
-            flash('Employee not found', 'danger')
-            return redirect(url_for('admin_dashboard'))
+            return generation_result('Employee not found', url_for('admin_dashboard'), 'danger')
         
         # Get company
         company_id = form_data.get('company')
         company = None
         if company_id:
             try:
-                company = Company.query.get(int(company_id))
+                company = COMPANY_CACHE.get(int(company_id))
             except (ValueError, TypeError):
                 company = None
         
         if not company:
-            flash('Company not found', 'danger')
-            return redirect(url_for('admin_dashboard'))
+            return generation_result('Company not found', url_for('admin_dashboard'), 'danger')
         
         # Check required data
         if not employee.resignation_datetime:
-            flash('Resignation date and time not found. Please save resignation details first.', 'danger')
-            return redirect(url_for('view_employee', emp_id=employee.id))
+            return generation_result('Resignation date and time not found. Please save resignation details first.', url_for('view_employee', emp_id=employee.id), 'danger')
         
         if not employee.relieving_date:
-            flash('Relieving date not found. Please save resignation details first.', 'danger')
-            return redirect(url_for('view_employee', emp_id=employee.id))
+            return generation_result('Relieving date not found. Please save resignation details first.', url_for('view_employee', emp_id=employee.id), 'danger')
         
         # Prepare data for template
         name_parts = employee.full_name.split() if employee.full_name else ['']
@@ -1688,8 +3365,7 @@ def generate():
         
         # Convert to PDF
         if not html_to_pdf(html_content, file_path):
-            flash('Failed to generate PDF document', 'danger')
-            return redirect(url_for('view_employee', emp_id=employee.id))
+            return generation_result('Failed to generate PDF document', url_for('view_employee', emp_id=employee.id), 'danger')
         
         # Save document record
         document = Document(
@@ -1699,56 +3375,44 @@ def generate():
             file_path=file_path,
             month=datetime.now().strftime('%B'),
             year=datetime.now().year,
-            generated_by=session.get('admin_username', 'admin'),
+            generated_by=admin_username or 'admin',
             generated_at=datetime.now()
         )
         db.session.add(document)
         
-        # Upload to Drive if requested
+        # Upload to Drive in the background if requested
         if upload_to_drive_flag:
-            try:
-                drive_file_id = upload_file_to_drive(file_path, filename, 'Resignation Letters', employee)
-                if drive_file_id:
-                    document.drive_file_id = drive_file_id
-            except Exception as e:
-                print(f"Drive upload failed: {e}")
+            queue_drive_upload(document, 'Resignation Letters')
         
         db.session.commit()
         
-        # Clear session data
-        session.pop('form_data', None)
-        session.pop('selected_months', None)
-        
-        flash(f'✅ Resignation acceptance letter generated successfully for {employee.full_name}!', 'success')
-        return redirect(url_for('admin_dashboard'))
+        return generation_result(f'✅ Resignation acceptance letter generated successfully for {employee.full_name}!', url_for('admin_dashboard'), 'success', documents=[document])
     
     # ========== INTERN DOCUMENTS HANDLER ==========
     if doc_type in ['intern_offer_letter', 'certificate_of_internship']:
-        # Get intern from session
+        # Get intern
         intern_id = form_data.get('intern_id')
         intern = None
         if intern_id:
             intern = Intern.query.get(intern_id)
         
         if not intern:
-            flash('Intern not found', 'danger')
-            return redirect(url_for('admin_dashboard'))
+            return generation_result('Intern not found', url_for('admin_dashboard'), 'danger')
         
         # Get company
         company_id = form_data.get('company')
         company = None
         if company_id:
             try:
-                company = Company.query.get(int(company_id))
+                company = COMPANY_CACHE.get(int(company_id))
             except (ValueError, TypeError):
                 company = None
         
         if not company:
-            flash('Company not found', 'danger')
-            return redirect(url_for('admin_dashboard'))
+            return generation_result('Company not found', url_for('admin_dashboard'), 'danger')
         
-        # Get preview data from session or calculate
-        data = session.get('intern_preview_data')
+        # Get preview data captured with the request or calculate
+        data = payload.get('intern_preview_data')
         
         if not data:
             # Calculate fresh data with fallbacks
@@ -1828,8 +3492,7 @@ def generate():
             
             # Convert to PDF
             if not html_to_pdf(html_content, file_path):
-                flash('Failed to generate PDF document. Check server logs for details.', 'danger')
-                return redirect(url_for('admin_dashboard', tab='document_generator'))
+                return generation_result('Failed to generate PDF document. Check server logs for details.', url_for('admin_dashboard', tab='document_generator'), 'danger')
             
             # Save document record
             document = InternDocument(
@@ -1837,74 +3500,28 @@ def generate():
                 document_type=doc_type,
                 filename=filename,
                 file_path=file_path,
-                generated_by=session.get('admin_username', 'admin'),
+                generated_by=admin_username or 'admin',
                 generated_at=datetime.now()
             )
             db.session.add(document)
             db.session.commit()
             
-            #Upload to Drive if requested
+            #Upload to Drive in the background if requested
             if upload_to_drive_flag:
-                try:
-                    # Create drive folder structure for interns
-                    service, error = get_drive_service()
-                    if not error:
-                        intern_folder_name = f"{intern.intern_id}_{intern.full_name.replace(' ', '_')}"
-                        folder_response = service.files().list(
-                            q=f"name='{intern_folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
-                            spaces='drive', fields='files(id)'
-                        ).execute()
-                        folders = folder_response.get('files', [])
-                        if folders:
-                            parent_folder_id = folders[0]['id']
-                        else:
-                            file_metadata = {'name': intern_folder_name, 'mimeType': 'application/vnd.google-apps.folder'}
-                            folder = service.files().create(body=file_metadata, fields='id').execute()
-                            parent_folder_id = folder.get('id')
-                        
-                        doc_folder_map = {
-                            'intern_offer_letter': 'Offer Letters',
-                            'certificate_of_internship': 'Certificates'
-                        }
-                        folder_name = doc_folder_map.get(doc_type, 'Documents')
-                        
-                        folder_response = service.files().list(
-                            q=f"name='{folder_name}' and '{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-                            spaces='drive', fields='files(id)'
-                        ).execute()
-                        subfolders = folder_response.get('files', [])
-                        if subfolders:
-                            target_folder_id = subfolders[0]['id']
-                        else:
-                            file_metadata = {'name': folder_name, 'mimeType': 'application/vnd.google-apps.folder', 'parents': [parent_folder_id]}
-                            subfolder = service.files().create(body=file_metadata, fields='id').execute()
-                            target_folder_id = subfolder.get('id')
-                        
-                        media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
-                        file = service.files().create(
-                            body={'name': filename, 'parents': [target_folder_id]},
-                            media_body=media,
-                            fields='id'
-                        ).execute()
-                        document.drive_file_id = file.get('id')
-                        db.session.commit()
-                except Exception as e:
-                    print(f"Drive upload failed: {e}")
+                doc_folder_map = {
+                    'intern_offer_letter': 'Offer Letters',
+                    'certificate_of_internship': 'Certificates'
+                }
+                queue_drive_upload(document, doc_folder_map.get(doc_type, 'Documents'))
+                db.session.commit()
             
-            # Clear session data
-            session.pop('form_data', None)
-            session.pop('intern_preview_data', None)
-            session.pop('selected_months', None)
-            
-            flash(f'✅ {doc_type.replace("_", " ").title()} generated successfully for {intern.full_name}!', 'success')
-            return redirect(url_for('admin_dashboard', tab='document_generator'))
+            return generation_result(f'✅ {doc_type.replace("_", " ").title()} generated successfully for {intern.full_name}!', url_for('admin_dashboard', tab='document_generator'), 'success', documents=[document])
             
         except Exception as e:
             print(f"❌ Error generating intern document: {e}")
             import traceback
             traceback.print_exc()
-            flash(f'Error generating document: {str(e)}', 'danger')
-            return redirect(url_for('admin_dashboard', tab='document_generator'))
+            return generation_result(f'Error generating document: {str(e)}', url_for('admin_dashboard', tab='document_generator'), 'danger')
     
     # ------------------------- FIND EMPLOYEE -------------------------
     employee = None
@@ -1912,8 +3529,7 @@ def generate():
         employee = Employee.query.filter_by(employee_id=form_data.get('employee_id')).first()
 
     if not employee:
-        flash('Employee not found', 'danger')
-        return redirect(url_for('admin_dashboard'))
+        return generation_result('Employee not found', url_for('admin_dashboard'), 'danger')
 
     # Get base values
     ctc = float(form_data.get('ctc') or 0)
@@ -1923,152 +3539,152 @@ def generate():
     company_id = form_data.get('company')
     if company_id:
         try:
-            company = Company.query.get(int(company_id))
+            company = COMPANY_CACHE.get(int(company_id))
         except (ValueError, TypeError):
             company = None
     else:
         company = None
 
     if not company:
-        flash('Company not found.', 'danger')
-        return redirect(url_for('admin_dashboard'))
+        return generation_result('Company not found.', url_for('admin_dashboard'), 'danger')
 
     watermark_logo = company.logo
 
     # ------------------------- PENDING INCREMENT -------------------------
     should_update_increment = False
     pending = None
-    if doc_type == 'increment_letter' and 'pending_increment' in session:
+    if doc_type == 'increment_letter' and payload.get('pending_increment'):
         should_update_increment = True
-        pending = session['pending_increment']
+        pending = payload['pending_increment']
         # Add document date to form_data for template
         if pending and 'document_date' in pending:
             form_data['document_date'] = pending['document_date']
         if pending and 'effective_date_formatted' in pending:
             form_data['increment_effective_date_formatted'] = pending['effective_date_formatted']
 
-    # Retrieve per‑month values from session
-    per_month_values = session.get('per_month_values', {})
+    # Retrieve per‑month values captured with the request
+    per_month_values = payload.get('per_month_values') or {}
     
     # ==================== SALARY SLIP (multiple months) ====================
     if doc_type == "salary_slip" and selected_months:
-        uploaded_files = []
         files_generated = []
         failed_months = []
+        created_docs = []
+        combine_pdf = bool(payload.get('combine_pdf'))
+        selected_year = payload.get('selected_year') or datetime.now().year
         
-        month_days_values = session.get('month_days_values', {})
+        month_days_values = payload.get('month_days_values') or {}
 
+        slips = []
         for month in selected_months:
-            print(f"\n--- Processing month: {month} ---")
-            
             pm = per_month_values.get(month, {})
-            paid_days = pm.get('paid', 30)
-            month_days = month_days_values.get(month, 30)
-            
-            components = calculate_salary_components(
-                ctc=ctc,
-                increment_per_month=increment_per_month,
-                paid_days=paid_days,
-                month_days=month_days
-            )
-            
-            month_form_data = {
-                'employee_id': form_data.get('employee_id'),
-                'company': company.id,
-                'document_type': doc_type,
-                'full_name': form_data.get('full_name'),
-                'address': form_data.get('address'),
-                'aadhar_no': form_data.get('aadhar_no'),
-                'pan_no': form_data.get('pan_no'),
-                'designation': form_data.get('designation'),
-                'gender': form_data.get('gender'),
-                'department': form_data.get('department'),
-                'ctc': ctc,
-                'increment_per_month': increment_per_month,
-                'month': month,
-                'basic': components['basic'],
-                'hra': components['hra'],
-                'conveyance': components['conveyance'],
-                'medical': components['medical'],
-                'telephone': components['telephone'],
-                'special_allowance': components['special_allowance'],
-                'gross_earnings': components['gross_earnings'],
-                'professional_tax': components['professional_tax'],
-                'pf_amount': components['pf_amount'],
-                'income_tax': components['income_tax'],
-                'gross_deductions': components['gross_deductions'],
-                'net_salary': components['net_salary'],
-                'words': num2words(int(components['net_salary']), lang='en_IN').title() + ' Rupees',
-                'worked_days': pm.get('worked', 30),
-                'lop': pm.get('lop', 0),
-                'paid_days': paid_days,
-                'month_days': month_days,
-                'joining_date': form_data.get('joining_date'),
-                'resignation_date': form_data.get('resignation_date'),
-                'bank_details': form_data.get('bank_details', {})
-            }
-
-            html = render_template(
-                "documents/salary_slip.html",
-                data=month_form_data,
+            slips.append(build_salary_slip(
+                form_data, company, month, selected_year,
+                paid_days=pm.get('paid', 30),
+                month_days=month_days_values.get(month, 30),
+                worked_days=pm.get('worked', 30),
+                lop=pm.get('lop', 0)
+            ))
+
+        date_stamp = datetime.now().strftime('%Y%m%d')
+
+        def render_slips(batch_slips):
+            return render_template(
+                "documents/salary_slips_preview.html",
+                slips=batch_slips,
+                slip_batch=True,
                 company=company,
                 watermark_logo=watermark_logo,
                 now=datetime.now()
             )
 
-            filename = f"Salary_Slip_{month}_{datetime.now().strftime('%Y%m%d')}.pdf"
+        if combine_pdf:
+            # All months go through WeasyPrint as one document
+            combined_filename = f"Salary_Slips_{selected_year}_{len(selected_months)}_months_{date_stamp}.pdf"
+            combined_path = os.path.join(app.config['UPLOAD_FOLDER'], combined_filename)
 
-            #always save local file first
-            local_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            if html_to_pdf(html, local_file_path):
-                files_generated.append(month)
+            print(f"\n--- Rendering {len(selected_months)} salary slips in one pass ---")
+            report(0, 1, 'Rendering salary slips')
+            try:
+                render_pdf_sections(render_slips(slips), [], combined_path=combined_path)
+            except Exception as e:
+                print(f"❌ Salary slip batch render failed: {e}")
+                traceback.print_exc()
 
-                #save document record with local path
+            if os.path.exists(combined_path):
+                files_generated = list(selected_months)
                 doc = Document(
                     employee_id=employee.id,
                     document_type=doc_type,
-                    filename=filename,
-                    file_path=local_file_path,
-                    month=month,
-                    year=session.get('selected_year', datetime.now().year),
-                    generated_by=session.get('admin_username', 'system'),
+                    filename=combined_filename,
+                    file_path=combined_path,
+                    month=None,
+                    year=selected_year,
+                    generated_by=admin_username or 'system',
                     drive_file_id=None
                 )
-
-                # Upload to Drive if requested
-                if upload_to_drive_flag:
-                    try:
-                        drive_file_id = upload_file_to_drive(local_file_path, filename, f"Salary Slips/{month}", employee)
-                        if drive_file_id:
-                            doc.drive_file_id = drive_file_id
-                    except Exception as e:
-                        print(f"Drive upload error: {e}")
-                
                 db.session.add(doc)
+                if upload_to_drive_flag:
+                    queue_drive_upload(doc, "Salary Slips")
+                created_docs.append(doc)
             else:
-                failed_months.append(month)
+                failed_months = list(selected_months)
+            report(1, 1, 'Saved combined salary slips')
+        else:
+            # One batch per render worker: each batch is laid out in a single pass and
+            # split per month
+            paths = {
+                month: os.path.join(app.config['UPLOAD_FOLDER'], f"Salary_Slip_{month}_{date_stamp}.pdf")
+                for month in selected_months
+            }
+            batches = []
+            for batch in split_batches(list(zip(selected_months, slips)), app.config['PDF_RENDER_WORKERS']):
+                sections = [(f"slip-{i}", paths[month]) for i, (month, _) in enumerate(batch)]
+                batches.append((render_slips([slip for _, slip in batch]), sections))
+
+            print(f"\n--- Rendering {len(selected_months)} salary slips in {len(batches)} batches ---")
+            outcomes = render_pipeline(batches, progress=report)
+
+            docs = []
+            for month in selected_months:
+                outcome = outcomes.get(paths[month], {})
+                if not outcome.get('pages'):
+                    failed_months.append(month)
+                    continue
+
+                files_generated.append(month)
+                #save document record with local path
+                docs.append(Document(
+                    employee_id=employee.id,
+                    document_type=doc_type,
+                    filename=os.path.basename(paths[month]),
+                    file_path=paths[month],
+                    month=month,
+                    year=selected_year,
+                    generated_by=admin_username or 'system',
+                    drive_file_id=None
+                ))
+
+            # Inserted together when the run commits
+            db.session.add_all(docs)
+            created_docs.extend(docs)
+            if upload_to_drive_flag:
+                for doc in docs:
+                    queue_drive_upload(doc, f"Salary Slips/{doc.month}")
 
-            with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp_file:
-                temp_path = tmp_file.name
+        if failed_months:
+            print(f"⚠️ Salary slips not generated for: {', '.join(failed_months)}")
 
         if files_generated:
             db.session.commit()
-            session.pop('form_data', None)
-            session.pop('selected_months', None)
-            session.pop('selected_year', None)
-            session.pop('per_month_values', None)
-            session.pop('month_days_values', None)
-            session.pop('pending_increment', None)
 
             if upload_to_drive_flag:
-                flash(f'{len(files_generated)} salary slips uploaded to Drive!', 'success')
+                message = f'{len(files_generated)} salary slips generated, Drive upload queued!'
             else:
-                flash(f'{len(files_generated)} salary slips generated successfully!', 'success')
-
-            return redirect(url_for('admin_dashboard'))
+                message = f'{len(files_generated)} salary slips generated successfully!'
+            return generation_result(message, url_for('admin_dashboard'), 'success', documents=created_docs)
 
-        flash('Failed to generate any salary slips', 'danger')
-        return redirect(url_for('admin_dashboard'))
+        return generation_result('Failed to generate any salary slips', url_for('admin_dashboard'), 'danger')
 
     # ==================== OTHER DOCUMENTS ====================
     components = calculate_salary_components(
@@ -2132,9 +3748,9 @@ def generate():
     # ========== Save local file first ==========
     local_file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
 
+    report(0, 1, 'Rendering PDF')
     if not html_to_pdf(html, local_file_path):
-        flash('Failed to generate PDF', 'danger')
-        return redirect(url_for('admin_dashboard'))
+        return generation_result('Failed to generate PDF', url_for('admin_dashboard'), 'danger')
 
     if should_update_increment and employee and pending:
         try:
@@ -2148,48 +3764,578 @@ def generate():
                 increment_amount=increment_amount,
                 new_ctc=new_ctc,
                 effective_date=datetime.strptime(pending['effective_date'], '%Y-%m-%d').date() if pending['effective_date'] else None,
-                generated_by=session.get('admin_username', 'system')
+                generated_by=admin_username or 'system'
             )
             db.session.add(history)
-            session.pop('pending_increment', None)
+            employee.refresh_ctc()
         except Exception as e:
             print("Increment Update Error:", e)
             db.session.rollback()
 
-    drive_file_id = None
-    if upload_to_drive_flag and employee:
-        try:
+    created_docs = []
+    if employee:
+        doc = Document(
+            employee_id=employee.id,
+            document_type=doc_type,
+            filename=filename,
+            file_path=local_file_path,
+            generated_by=admin_username or 'system',
+            drive_file_id=None
+        )
+        db.session.add(doc)
+        created_docs.append(doc)
+        if upload_to_drive_flag:
             folder_map = {
                 'offer_letter': 'Offer Letters',
                 'experience_letter': 'Experience Letters',
                 'increment_letter': 'Increment Letters',
                 'relieving_letter': 'Relieving Letters'
             }
-            folder_name = folder_map.get(doc_type, 'Other Documents')
-            drive_file_id = upload_file_to_drive(local_file_path, filename, folder_name, employee)
+            queue_drive_upload(doc, folder_map.get(doc_type, 'Other Documents'))
+
+    db.session.commit()
+    report(1, 1, 'Done')
+
+    return generation_result(f'{doc_type.replace("_", " ").title()} generated successfully!', url_for('admin_dashboard'), 'success', documents=created_docs)
+
+# ========== BACKGROUND GENERATION JOBS ==========
+# /generate snapshots the preview state into a generation_job row and returns at
+# once; worker threads in each app process claim queued rows and run them through
+# run_generation(). The table is the queue, so jobs survive restarts and any
+# process can pick them up. GENERATION_WORKERS=0 keeps everything in-request.
+app.config['GENERATION_WORKERS'] = int(os.getenv('GENERATION_WORKERS', 2))
+app.config['GENERATION_POLL_INTERVAL'] = float(os.getenv('GENERATION_POLL_INTERVAL', 2))
+app.config['GENERATION_JOB_STALE_AFTER'] = int(os.getenv('GENERATION_JOB_STALE_AFTER', 600))
+app.config['GENERATION_JOB_MAX_ATTEMPTS'] = int(os.getenv('GENERATION_JOB_MAX_ATTEMPTS', 2))
+app.config['GENERATION_JOB_RETENTION_DAYS'] = int(os.getenv('GENERATION_JOB_RETENTION_DAYS', 7))
+
+# Preview state that a successful generation consumes
+GENERATION_SESSION_KEYS = (
+    'form_data', 'selected_months', 'selected_year', 'per_month_values',
+    'month_days_values', 'pending_increment', 'intern_preview_data',
+)
+
+_generation_wakeup = threading.Event()
+_generation_workers = {'pid': None, 'threads': []}
+_generation_workers_lock = threading.Lock()
+
+
+def generation_result(message, redirect_url, category='success', documents=()):
+    """Outcome of run_generation(), flashed inline or stored on the job"""
+    return {
+        'ok': category != 'danger',
+        'message': message,
+        'category': category,
+        'redirect': redirect_url,
+        'documents': [
+            {'id': doc.id, 'filename': doc.filename, 'intern': isinstance(doc, InternDocument)}
+            for doc in documents
+        ],
+    }
+
+
+def generation_payload():
+    """Snapshot the session and form state that run_generation() works from"""
+    payload = {key: session.get(key) for key in GENERATION_SESSION_KEYS}
+    payload.update({
+        'admin_username': session.get('admin_username'),
+        'upload_to_drive': request.form.get('upload_to_drive') == 'true',
+        'combine_pdf': request.form.get('combine_pdf') == 'true',
+        'base_url': request.url_root,
+    })
+    return payload
+
+
+def finish_generation(result):
+    """Flash a generation result and clear the preview state it was built from"""
+    flash(result['message'], result['category'])
+    if result['ok'] and result.get('clears_preview', True):
+        for key in GENERATION_SESSION_KEYS:
+            session.pop(key, None)
+
+
+def _update_generation_job(job_id, expected_status=None, **values):
+    """Write job state on its own connection so it never commits the ORM session's pending work"""
+    table = GenerationJob.__table__
+    query = table.update().where(table.c.id == job_id)
+    if expected_status:
+        query = query.where(table.c.status == expected_status)
+    with db.engine.begin() as conn:
+        return conn.execute(query.values(**values)).rowcount
+
+
+def enqueue_generation_job(payload, document_type=None):
+    form_data = payload.get('form_data') or {}
+    job = GenerationJob(
+        document_type=document_type or form_data.get('document_type'),
+        payload=json.dumps(payload, default=str),
+        created_by=payload.get('admin_username'),
+    )
+    db.session.add(job)
+    db.session.commit()
+    print(f"🧾 Queued generation job {job.id} ({job.document_type})")
+    start_generation_workers()
+    _generation_wakeup.set()
+    return job
+
+
+def claim_generation_job(worker_name):
+    """Move the oldest queued job to running; returns its id, or None if nothing was claimed"""
+    table = GenerationJob.__table__
+    with db.engine.begin() as conn:
+        job_id = conn.execute(
+            db.select(table.c.id)
+            .where(table.c.status == 'queued')
+            .order_by(table.c.created_at)
+            .limit(1)
+        ).scalar()
+        if not job_id:
+            return None
+        now = datetime.now()
+        # The status guard makes the claim atomic across threads and processes
+        claimed = conn.execute(
+            table.update()
+            .where(table.c.id == job_id, table.c.status == 'queued')
+            .values(status='running', worker=worker_name, attempts=table.c.attempts + 1,
+                    started_at=now, heartbeat_at=now)
+        ).rowcount
+    return job_id if claimed else None
+
+
+def maintain_generation_jobs():
+    """Requeue (or fail) jobs whose worker stopped heartbeating and prune old finished jobs"""
+    table = GenerationJob.__table__
+    now = datetime.now()
+    stale_before = now - timedelta(seconds=app.config['GENERATION_JOB_STALE_AFTER'])
+    stale = db.and_(table.c.status == 'running', table.c.heartbeat_at < stale_before)
+    with db.engine.begin() as conn:
+        requeued = conn.execute(
+            table.update()
+            .where(stale, table.c.attempts < app.config['GENERATION_JOB_MAX_ATTEMPTS'])
+            .values(status='queued', worker=None)
+        ).rowcount
+        failed = conn.execute(
+            table.update()
+            .where(stale)
+            .values(status='failed', error='Worker stopped responding', finished_at=now)
+        ).rowcount
+        conn.execute(
+            table.delete().where(
+                table.c.status.in_(('done', 'failed')),
+                table.c.finished_at < now - timedelta(days=app.config['GENERATION_JOB_RETENTION_DAYS'])
+            )
+        )
+    if requeued or failed:
+        print(f"♻️ Stale generation jobs: {requeued} requeued, {failed} failed")
+
+
+def execute_generation_job(job_id, worker_name=None):
+    """Run a claimed job inside a request context for its original host and record the outcome"""
+    with app.app_context():
+        payload = json.loads(db.session.get(GenerationJob, job_id).payload)
+
+    def progress(done, total, message=None):
+        _update_generation_job(
+            job_id, expected_status='running',
+            progress_done=done, progress_total=total,
+            progress_message=(message or '')[:200], heartbeat_at=datetime.now()
+        )
+
+    runners = {'payroll_run': run_payroll, 'drive_cleanup': run_drive_cleanup}
+    runner = runners.get(payload.get('kind'), run_generation)
+    started = time.time()
+    with app.test_request_context('/generate', method='POST', base_url=payload.get('base_url')):
+        try:
+            result = runner(payload, progress)
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Generation job {job_id} failed: {e}")
+            traceback.print_exc()
+            _update_generation_job(job_id, expected_status='running', status='failed',
+                                   error=str(e), finished_at=datetime.now())
+            return
+        _update_generation_job(
+            job_id, expected_status='running',
+            status='done' if result['ok'] else 'failed',
+            result=json.dumps(result),
+            error=None if result['ok'] else result['message'],
+            finished_at=datetime.now()
+        )
+    print(f"✅ Generation job {job_id} finished in {time.time() - started:.1f}s ({worker_name or 'inline'})")
+
+
+def _generation_worker_loop(worker_name):
+    while True:
+        try:
+            with app.app_context():
+                maintain_generation_jobs()
+                job_id = claim_generation_job(worker_name)
+            if job_id:
+                execute_generation_job(job_id, worker_name)
+                continue
         except Exception as e:
-            print("Drive Upload Error:", e)
+            print(f"⚠️ Generation worker {worker_name} error: {e}")
+        _generation_wakeup.wait(app.config['GENERATION_POLL_INTERVAL'])
+        _generation_wakeup.clear()
+
+
+def start_generation_workers():
+    """Start this process's worker threads once; forked processes start their own"""
+    if app.config['GENERATION_WORKERS'] <= 0:
+        return
+    with _generation_workers_lock:
+        if _generation_workers['pid'] == os.getpid():
+            return
+        _generation_workers['pid'] = os.getpid()
+        _generation_workers['threads'] = []
+        for i in range(app.config['GENERATION_WORKERS']):
+            worker_name = f"{os.getpid()}-{i}"
+            thread = threading.Thread(
+                target=_generation_worker_loop, args=(worker_name,),
+                name=f"generation-worker-{worker_name}", daemon=True
+            )
+            thread.start()
+            _generation_workers['threads'].append(thread)
+        print(f"✅ Started {app.config['GENERATION_WORKERS']} generation workers in process {os.getpid()}")
 
-    if employee:
-        doc = Document(
-            employee_id=employee.id,
-            document_type=doc_type,
-            filename=filename,
-            file_path=local_file_path,
-            generated_by=session.get('admin_username', 'system'),
-            drive_file_id=drive_file_id
+
+@app.before_request
+def ensure_generation_workers():
+    # Picks up jobs queued before a restart as soon as the process serves traffic
+    start_generation_workers()
+
+
+@app.route('/generate', methods=['POST'])
+def generate():
+    payload = generation_payload()
+    wants_job = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
+    if not payload['form_data']:
+        if wants_job:
+            return jsonify({'error': 'Nothing to generate, please preview the document again'}), 400
+        return redirect(url_for('index'))
+
+    if wants_job and app.config['GENERATION_WORKERS'] > 0:
+        job = enqueue_generation_job(payload)
+        session['generation_job_id'] = job.id
+        data = job.to_dict()
+        data['status_url'] = url_for('job_status', job_id=job.id)
+        return jsonify(data), 202
+
+    # Plain form post (or workers disabled): generate within the request
+    result = run_generation(payload)
+    finish_generation(result)
+    return redirect(result['redirect'])
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    if not session.get('is_admin') and session.get('generation_job_id') != job_id:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = db.session.get(GenerationJob, job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    data = job.to_dict()
+    result = data['result'] or generation_result(
+        f'Error generating document: {job.error}', url_for('admin_dashboard'), 'danger'
+    )
+    data['redirect'] = result['redirect']
+
+    # The first poll that sees the job finished reports it like the inline path would
+    if job.status in ('done', 'failed') and session.get('generation_job_id') == job.id:
+        session.pop('generation_job_id', None)
+        finish_generation(result)
+
+    return jsonify(data)
+
+# ========== PAYROLL RUN ==========
+# Salary slips for every active employee for one month. Slips are grouped by
+# company (the batch template shares one letterhead and watermark) and laid out
+# in batches of at most PAYROLL_BATCH_SIZE through render_pipeline().
+app.config['PAYROLL_BATCH_SIZE'] = int(os.getenv('PAYROLL_BATCH_SIZE', 25))
+
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June',
+               'July', 'August', 'September', 'October', 'November', 'December']
+
+def parse_lop_overrides(stream):
+    """
+    Read per-employee LOP overrides from a CSV with an employee_id and lop
+    column, and optional worked_days / paid_days columns.
+    Returns {employee_id: {'lop': n, 'worked': n_or_None, 'paid': n_or_None}}.
+    """
+    reader = csv.DictReader(stream)
+    fields = {(name or '').strip().lower() for name in (reader.fieldnames or [])}
+    if not {'employee_id', 'lop'} <= fields:
+        raise ValueError("CSV needs employee_id and lop columns")
+
+    overrides = {}
+    for line_no, row in enumerate(reader, start=2):
+        row = {(key or '').strip().lower(): (value or '').strip() for key, value in row.items()}
+        if not row.get('employee_id'):
+            continue
+        try:
+            overrides[row['employee_id']] = {
+                'lop': int(row.get('lop') or 0),
+                'worked': int(row['worked_days']) if row.get('worked_days') else None,
+                'paid': int(row['paid_days']) if row.get('paid_days') else None,
+            }
+        except ValueError:
+            raise ValueError(f"Line {line_no}: days must be whole numbers")
+    return overrides
+
+def employee_slip_fields(employee):
+    """The form_data fields build_salary_slip() needs, taken from an Employee"""
+    return {
+        'employee_id': employee.employee_id,
+        'full_name': employee.full_name,
+        'address': employee.address,
+        'aadhar_no': employee.aadhar_no,
+        'pan_no': employee.pan_no,
+        'designation': employee.designation,
+        'gender': employee.gender,
+        'department': employee.department,
+        'ctc': employee.ctc,
+        'increment_per_month': 0,
+        'joining_date': employee.joining_date,
+        'resignation_date': employee.resignation_date,
+        'bank_details': {
+            'account_holder': employee.account_holder,
+            'account_number': employee.account_number,
+            'bank_name': employee.bank_name,
+            'branch': employee.branch,
+            'ifsc_code': employee.ifsc_code
+        }
+    }
+
+def run_payroll(payload, progress=None):
+    """
+    Generate salary slips for all active employees for payload['month'] /
+    payload['year']. Employees without a company fall back to
+    payload['company_id']; those still without one are skipped, as are
+    employees who already have a slip for that month, so a run can be
+    repeated after a partial failure without duplicating slips.
+    Returns a generation_result() dict with the throughput in its message.
+    """
+    month = payload['month']
+    year = int(payload['year'])
+    overrides = payload.get('lop_overrides') or {}
+    upload_to_drive_flag = bool(payload.get('upload_to_drive'))
+    admin_username = payload.get('admin_username') or 'system'
+    report = progress or (lambda done, total, message=None: None)
+    started = time.time()
+
+    fallback_company = db.session.get(Company, int(payload['company_id'])) if payload.get('company_id') else None
+    employees = (
+        Employee.query
+        .filter_by(status='active')
+        .options(db.joinedload(Employee.company))
+        .order_by(Employee.employee_id)
+        .all()
+    )
+
+    already_generated = set(db.session.execute(
+        db.select(Document.employee_id).where(Document.document_type == 'salary_slip',
+                                              Document.month == month, Document.year == year)
+    ).scalars())
+
+    month_days = get_days_in_month(month, year)
+    date_stamp = datetime.now().strftime('%Y%m%d')
+    by_company = {}
+    skipped = []
+    existing = []
+    for employee in employees:
+        if employee.id in already_generated:
+            existing.append(employee.employee_id)
+            continue
+        company = employee.company or fallback_company
+        if not company:
+            skipped.append(employee.employee_id)
+            continue
+        override = overrides.get(employee.employee_id, {})
+        lop = override.get('lop') or 0
+        slip = build_salary_slip(
+            employee_slip_fields(employee), company, month, year,
+            paid_days=override.get('paid') if override.get('paid') is not None else month_days - lop,
+            month_days=month_days,
+            worked_days=override.get('worked') if override.get('worked') is not None else month_days - lop,
+            lop=lop
         )
-        db.session.add(doc)
+        filename = secure_filename(f"Salary_Slip_{employee.employee_id}_{month}_{year}_{date_stamp}.pdf")
+        entry = {
+            'employee_id': employee.id,
+            'owner': SimpleNamespace(employee_id=employee.employee_id, full_name=employee.full_name),
+            'slip': slip,
+            'path': os.path.join(app.config['UPLOAD_FOLDER'], filename),
+        }
+        by_company.setdefault(company.id, (company, []))[1].append(entry)
+
+    if skipped:
+        print(f"⚠️ Payroll run skipped {len(skipped)} employees without a company: {', '.join(skipped)}")
+    if existing:
+        print(f"ℹ️ Payroll run skipped {len(existing)} employees who already have a {month} {year} slip")
+
+    entries = [entry for _, group in by_company.values() for entry in group]
+    if not entries:
+        if existing:
+            return generation_result(f'Salary slips for {month} {year} were already generated for '
+                                     f'{len(existing)} employees; nothing left to run',
+                                     url_for('admin_dashboard'), 'info')
+        return generation_result(f'No active employees to run payroll for {month} {year}',
+                                 url_for('admin_dashboard'), 'warning')
+
+    # Enough batches to keep every render worker busy, none larger than PAYROLL_BATCH_SIZE
+    workers = max(1, app.config['PDF_RENDER_WORKERS'])
+    batch_size = max(1, min(app.config['PAYROLL_BATCH_SIZE'], -(-len(entries) // workers)))
+    batches = []
+    for company, group in by_company.values():
+        for start in range(0, len(group), batch_size):
+            batch = group[start:start + batch_size]
+            html = render_template(
+                "documents/salary_slips_preview.html",
+                slips=[entry['slip'] for entry in batch],
+                slip_batch=True,
+                company=company,
+                watermark_logo=company.logo,
+                now=datetime.now()
+            )
+            batches.append((html, [(f"slip-{i}", entry['path']) for i, entry in enumerate(batch)]))
+
+    print(f"\n--- Payroll run {month} {year}: {len(entries)} slips in {len(batches)} batches ---")
+    report(0, len(entries), f'Rendering {len(entries)} salary slips')
+    outcomes = render_pipeline(batches, progress=report)
+
+    rows = []
+    failed = []
+    generated_at = datetime.now()
+    for entry in entries:
+        outcome = outcomes.get(entry['path'], {})
+        if not outcome.get('pages'):
+            failed.append(entry['owner'].employee_id)
+            continue
+        rows.append({
+            'employee_id': entry['employee_id'],
+            'document_type': 'salary_slip',
+            'filename': os.path.basename(entry['path']),
+            'file_path': entry['path'],
+            'month': month,
+            'year': year,
+            'generated_at': generated_at,
+            'generated_by': admin_username,
+            'drive_file_id': None,
+        })
+
+    # One executemany INSERT for the whole run
+    if rows:
+        last_id = db.session.execute(db.select(db.func.max(Document.id))).scalar() or 0
+        db.session.execute(db.insert(Document), rows)
+        adjust_dashboard_counters(db.session.connection(), {'documents': len(rows)})
+        if upload_to_drive_flag:
+            # The slips are uploaded by the Drive outbox workers. Find the new rows by their
+            # file paths; generated_at is rounded by MySQL DATETIME so it can't be matched.
+            paths = [row['file_path'] for row in rows]
+            document_ids = []
+            for start in range(0, len(paths), 500):
+                document_ids += db.session.execute(
+                    db.select(Document.id).where(Document.id > last_id,
+                                                 Document.file_path.in_(paths[start:start + 500]))
+                ).scalars().all()
+            queue_drive_uploads('employee', document_ids, f"Salary Slips/{month}")
+        db.session.commit()
 
-    db.session.commit()
+    elapsed = time.time() - started
+    rate = len(rows) / elapsed if elapsed else 0
+    print(f"✅ Payroll run {month} {year}: {len(rows)} slips in {elapsed:.1f}s ({rate:.2f} slips/sec), "
+          f"{len(failed)} failed, {len(skipped)} skipped")
+
+    message = f'Payroll run {month} {year}: {len(rows)} salary slips in {elapsed:.1f}s ({rate:.2f} slips/sec)'
+    if failed:
+        message += f'; failed for {", ".join(failed)}'
+    if skipped:
+        message += f'; {len(skipped)} employees skipped (no company)'
+    if existing:
+        message += f'; {len(existing)} employees skipped (slip already generated)'
+    result = generation_result(message, url_for('admin_dashboard'), 'success' if rows else 'danger')
+    result.update({
+        'clears_preview': False,
+        'generated': len(rows),
+        'failed': failed,
+        'skipped': skipped,
+        'existing': existing,
+        'seconds': round(elapsed, 2),
+        'slips_per_second': round(rate, 2),
+    })
+    return result
 
-    session.pop('form_data', None)
-    session.pop('selected_months', None)
-    session.pop('selected_year', None)
-    session.pop('per_month_values', None)
+@app.route('/admin/payroll-run', methods=['GET', 'POST'])
+def payroll_run():
+    if not session.get('is_admin'):
+        return redirect(url_for('admin_login'))
 
-    flash(f'{doc_type.replace("_", " ").title()} generated successfully!', 'success')
-    return redirect(url_for('admin_dashboard'))
+    if request.method == 'POST':
+        month = request.form.get('month')
+        year = request.form.get('year', type=int)
+        if month not in MONTH_NAMES or not year:
+            flash('Please select a month and year.', 'danger')
+            return redirect(url_for('payroll_run'))
+
+        overrides = {}
+        lop_file = request.files.get('lop_csv')
+        if lop_file and lop_file.filename:
+            try:
+                overrides = parse_lop_overrides(io.StringIO(lop_file.read().decode('utf-8-sig')))
+            except (ValueError, UnicodeDecodeError) as e:
+                flash(f'Could not read LOP CSV: {e}', 'danger')
+                return redirect(url_for('payroll_run'))
+
+        payload = {
+            'kind': 'payroll_run',
+            'month': month,
+            'year': year,
+            'company_id': request.form.get('company', type=int),
+            'lop_overrides': overrides,
+            'upload_to_drive': request.form.get('upload_to_drive') == 'true',
+            'admin_username': session.get('admin_username'),
+            'base_url': request.url_root,
+        }
+
+        if app.config['GENERATION_WORKERS'] > 0:
+            job = enqueue_generation_job(payload, document_type='payroll_run')
+            session['generation_job_id'] = job.id
+            return redirect(url_for('payroll_run', job_id=job.id))
+
+        result = run_payroll(payload)
+        finish_generation(result)
+        return redirect(url_for('payroll_run'))
+
+    active_count = Employee.query.filter_by(status='active').count()
+    return render_template('payroll_run.html',
+                           companies=COMPANY_CACHE.all(),
+                           months=MONTH_NAMES,
+                           active_count=active_count,
+                           job_id=request.args.get('job_id'))
+
+@app.cli.command('payroll-run')
+@click.option('--month', required=True, type=click.Choice(MONTH_NAMES))
+@click.option('--year', required=True, type=int)
+@click.option('--company-id', type=int, help='Company for employees that have none')
+@click.option('--lop-csv', type=click.File('r', encoding='utf-8-sig'), help='CSV of employee_id,lop[,worked_days,paid_days]')
+@click.option('--upload', is_flag=True, help='Also upload the slips to Google Drive')
+def payroll_run_command(month, year, company_id, lop_csv, upload):
+    """Generate salary slips for every active employee for one month"""
+    payload = {
+        'kind': 'payroll_run',
+        'month': month,
+        'year': year,
+        'company_id': company_id,
+        'lop_overrides': parse_lop_overrides(lop_csv) if lop_csv else {},
+        'upload_to_drive': upload,
+        'admin_username': 'cli',
+    }
+    with app.test_request_context(base_url=app.config.get('PDF_BASE_URL')):
+        result = run_payroll(payload)
+    print(result['message'])
 
 @app.route('/generated_docs/<filename>')
 def serve_generated_file(filename):
@@ -2290,94 +4436,112 @@ def admin_dashboard():
     selected_member_id = request.args.get('member_id', type=int)
     selected_member_type = request.args.get('member_type', 'employee')
 
-    # Get all employees with their document counts
-    employees = Employee.query.order_by(Employee.created_at.desc()).all()
+    # Headline numbers come from the materialized counters; member rows are
+    # only loaded by the tabs that show them
+    counters = dashboard_counters()
+    employee_statuses = counted_statuses(counters, 'employees')
+    intern_statuses = counted_statuses(counters, 'interns')
+    total_employees = sum(employee_statuses.values())
+    total_interns = sum(intern_statuses.values())
+    active_employees = employee_statuses.get('active', 0)
+    active_interns = intern_statuses.get('active', 0)
 
     employee_data = []
-    total_documents = 0
-    for emp in employees:
-        doc_count = Document.query.filter_by(employee_id=emp.id).count()
-        total_documents += doc_count
-        latest_inc = IncrementHistory.query.filter_by(employee_id=emp.id).order_by(IncrementHistory.generated_at.desc()).first()
-        increment_amount = latest_inc.increment_amount if latest_inc else 0
-        employee_data.append({
-            'employee': emp,
-            'document_count': doc_count,
-            'increment_amount': increment_amount
-        })
-
-    # Get all interns (needed for members dashboard)
-    interns = Intern.query.order_by(Intern.created_at.desc()).all()
+    interns = []
+    intern_document_counts = {}
+    employee_page = intern_page = None
+    recent_employees = recent_interns = []
+    company_employee_counts = []
+    employee_query = Employee.query.options(db.joinedload(Employee.company))
+    intern_query = Intern.query.options(db.joinedload(Intern.company))
+
+    if active_tab == 'dashboard':
+        company_employee_counts = employee_counts_by_company()
+        recent_employees = employee_query.order_by(Employee.created_at.desc(), Employee.id.desc()).limit(5).all()
+        recent_interns = intern_query.order_by(Intern.created_at.desc(), Intern.id.desc()).limit(5).all()
+    elif active_tab == 'members':
+        # One page of each member type, newest first
+        employees, employee_page = keyset_page(
+            employee_query, Employee.created_at, Employee.id,
+            app.config['MEMBERS_PER_PAGE'], prefix='emp_'
+        )
+        interns, intern_page = keyset_page(
+            intern_query, Intern.created_at, Intern.id,
+            app.config['MEMBERS_PER_PAGE'], prefix='intern_'
+        )
+        employee_data = employee_cards(employees)
+        intern_document_counts = document_counts_by_intern([intern.id for intern in interns])
+    elif active_tab == 'document_generator':
+        # The member picker lists everyone
+        employee_data = employee_cards(employee_query.order_by(Employee.created_at.desc()).all())
+        interns = intern_query.order_by(Intern.created_at.desc()).all()
+
+    # Lightweight employee list for the create payment form
+    payment_employees = (
+        db.session.query(Employee.id, Employee.full_name, Employee.employee_id, Employee.designation)
+        .order_by(Employee.full_name)
+        .all()
+    )
 
-    total_employees = len(employees)
-    total_interns = len(interns)
-    active_employees = sum(1 for emp in employees if emp.status == 'active')
-    active_interns = sum(1 for intern in interns if intern.status == 'active')
+    # ========== EMPLOYEE PAYMENTS (NO INTERN PAYMENTS) ==========
+    # Stored statuses are kept current by mark_overdue_payments()
+    summary = counted_payment_summary(counters)
+    total_paid = summary['total_paid']
+    paid_count = summary['counts']['Paid']
+    pending_count = summary['counts']['Pending']
+    partial_count = summary['counts']['Partial']
+    overdue_count = summary['counts']['Overdue']
 
-    # ========== GET ALL EMPLOYEE PAYMENTS (NO INTERN PAYMENTS) ==========
+    # Only the payments tab shows rows, and only one page of them
     all_payments = []
-    
-    # Get employee payments only
-    emp_payments = db.session.query(
-        Payment.id,
-        Employee.full_name.label('employee_name'),
-        Employee.employee_id.label('employee_id'),
-        Payment.document_type,
-        Payment.amount,
-        Payment.paid_amt,
-        Payment.status,
-        Payment.payment_date,
-        Payment.due_date,
-        Payment.created_at
-    ).join(Employee, Payment.employee_id == Employee.id).all()
-    
-    for p in emp_payments:
-        due_amount = p.amount - p.paid_amt
-        if p.paid_amt >= p.amount:
-            status = 'Paid'
-            status_class = 'success'
-        elif p.paid_amt > 0:
-            status = 'Partial'
-            status_class = 'warning'
-        else:
-            status = 'Pending'
-            status_class = 'secondary'
-        
-        all_payments.append({
-            'id': p.id,
-            'employee_name': p.employee_name,
-            'employee_id': p.employee_id,
-            'document_type': p.document_type or 'N/A',
-            'amount': p.amount,
-            'paid_amt': p.paid_amt,
-            'due_amount': due_amount,
-            'status': status,
-            'status_class': status_class,
-            'payment_date': p.payment_date.strftime('%d %b %Y') if p.payment_date else 'N/A',
-            'due_date': p.due_date.strftime('%d %b %Y') if p.due_date else 'N/A',
-            'created_at': p.created_at.strftime('%d %b %Y') if p.created_at else 'N/A',
-        })
-    
-    # Sort all payments by created date (newest first)
-    all_payments.sort(key=lambda x: x['created_at'], reverse=True)
-    
-    # Calculate totals
-    total_amount = sum(p['amount'] for p in all_payments)
-    total_paid = sum(p['paid_amt'] for p in all_payments)
-    total_due = sum(p['due_amount'] for p in all_payments)
-    
-    # Count by status
-    paid_count = sum(1 for p in all_payments if p['status'] == 'Paid')
-    pending_count = sum(1 for p in all_payments if p['status'] == 'Pending')
-    partial_count = sum(1 for p in all_payments if p['status'] == 'Partial')
-    overdue_count = sum(1 for p in all_payments if p['status'] == 'Overdue')
-    
+    pagination = None
+    if active_tab == 'payments':
+        emp_payments, pagination = keyset_page(
+            db.session.query(
+                Payment.id,
+                Employee.full_name.label('employee_name'),
+                Employee.employee_id.label('employee_id'),
+                Payment.document_type,
+                Payment.amount,
+                Payment.paid_amt,
+                Payment.status,
+                Payment.payment_date,
+                Payment.due_date,
+                Payment.created_at
+            )
+            .join(Employee, Payment.employee_id == Employee.id),
+            Payment.created_at, Payment.id, app.config['PAYMENTS_PER_PAGE']
+        )
+
+        for p in emp_payments:
+            all_payments.append({
+                'id': p.id,
+                'employee_name': p.employee_name,
+                'employee_id': p.employee_id,
+                'document_type': p.document_type or 'N/A',
+                'amount': p.amount,
+                'paid_amt': p.paid_amt,
+                'due_amount': p.amount - p.paid_amt,
+                'status': p.status,
+                'status_class': payment_status_class(p.status),
+                'payment_date': p.payment_date.strftime('%d %b %Y') if p.payment_date else 'N/A',
+                'due_date': p.due_date.strftime('%d %b %Y') if p.due_date else 'N/A',
+                'created_at': p.created_at.strftime('%d %b %Y') if p.created_at else 'N/A',
+            })
+
     # Get companies for add member form
-    companies = Company.query.all()
+    companies = COMPANY_CACHE.all()
 
     return render_template('admin_dashboard.html',
                          employees=employee_data,
                          interns=interns,  # ← ADD THIS BACK
+                         intern_document_counts=intern_document_counts,
+                         employee_page=employee_page,
+                         intern_page=intern_page,
+                         recent_employees=recent_employees,
+                         recent_interns=recent_interns,
+                         company_employee_counts=company_employee_counts,
+                         payment_employees=payment_employees,
                          companies=companies,
                          active_tab=active_tab,
                          selected_emp_id=selected_emp_id,
@@ -2388,16 +4552,75 @@ def admin_dashboard():
                          total_interns=total_interns,  # ← ADD THIS BACK
                          active_employees=active_employees,
                          active_interns=active_interns,  # ← ADD THIS BACK
-                         total_documents=total_documents,
+                         total_documents=int(counters.get('documents', 0)),
                          pending_payments=pending_count,
                          paid_count=paid_count,
                          pending_count=pending_count,
                          partial_count=partial_count,
                          overdue_count=overdue_count,
                          paid_amount=total_paid,
-                         pending_amount=total_due,
-                         overdue_amount=0,
-                         payments=all_payments)
+                         pending_amount=summary['total_due'] - summary['due']['Overdue'],
+                         overdue_amount=summary['due']['Overdue'],
+                         payments=all_payments,
+                         pagination=pagination,
+                         pagination_total=summary['count'])
+
+@app.route('/admin/api/employees')
+def api_employees():
+    """JSON page of employees, newest first; pass after/before cursors to page"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    employees, page = keyset_page(
+        Employee.query.options(db.joinedload(Employee.company)),
+        Employee.created_at, Employee.id, app.config['MEMBERS_PER_PAGE']
+    )
+    
+    return jsonify({
+        'employees': [{
+            'id': item['employee'].id,
+            'employee_id': item['employee'].employee_id,
+            'full_name': item['employee'].full_name,
+            'designation': item['employee'].designation,
+            'department': item['employee'].department,
+            'status': item['employee'].status,
+            'company': item['employee'].company.name if item['employee'].company else None,
+            'ctc': item['ctc'],
+            'document_count': item['document_count'],
+            'joining_date': item['employee'].joining_date.isoformat() if item['employee'].joining_date else None,
+            'created_at': item['employee'].created_at.isoformat() if item['employee'].created_at else None,
+        } for item in employee_cards(employees)],
+        'page': page,
+    })
+
+@app.route('/admin/api/interns')
+def api_interns():
+    """JSON page of interns, newest first; pass after/before cursors to page"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    interns, page = keyset_page(
+        Intern.query.options(db.joinedload(Intern.company)),
+        Intern.created_at, Intern.id, app.config['MEMBERS_PER_PAGE']
+    )
+    document_counts = document_counts_by_intern([intern.id for intern in interns])
+    
+    return jsonify({
+        'interns': [{
+            'id': intern.id,
+            'intern_id': intern.intern_id,
+            'full_name': intern.full_name,
+            'qualification': intern.qualification,
+            'college_name': intern.college_name,
+            'status': intern.status,
+            'company': intern.company.name if intern.company else None,
+            'stipend': intern.stipend,
+            'document_count': document_counts.get(intern.id, 0),
+            'start_date': intern.start_date.isoformat() if intern.start_date else None,
+            'created_at': intern.created_at.isoformat() if intern.created_at else None,
+        } for intern in interns],
+        'page': page,
+    })
 
 @app.route('/admin/profile', methods=['GET', 'POST'])
 def admin_profile():
@@ -2427,20 +4650,17 @@ def delete_employee(emp_id):
         return redirect(url_for('admin_login'))
 
     employee = Employee.query.get_or_404(emp_id)
-    drive_folder_id = employee.drive_folder_id
+    owner = drive_owner_folder_name(employee)
+    # Drive IDs to clean up once the rows are gone: the documents, the folders
+    # the folder map knows about, and the employee's own folder last
+    drive_file_ids = [doc.drive_file_id for doc in employee.documents if doc.drive_file_id]
+    mapped_folders = DriveFolder.query.filter_by(owner=owner).all()
+    subfolder_ids = [entry.folder_id for entry in mapped_folders if entry.path]
+    root_folder_ids = [employee.drive_folder_id] + [entry.folder_id for entry in mapped_folders if not entry.path]
 
     try:
-        # Delete all related documents (and their Drive files)
+        # Delete local files of all related documents
         for doc in employee.documents:
-            if doc.drive_file_id:
-                # Delete the file from Drive
-                parent_id = get_parent_folder_id(doc.drive_file_id)
-                delete_drive_file(doc.drive_file_id)
-                # Optionally delete parent folder if empty (might be redundant)
-                if parent_id and is_folder_empty(parent_id):
-                    delete_drive_folder(parent_id)
-
-            # Delete local file if exists
             if doc.file_path and os.path.exists(doc.file_path):
                 try:
                     os.remove(doc.file_path)
@@ -2451,17 +4671,18 @@ def delete_employee(emp_id):
         for history in employee.increment_history:
             db.session.delete(history)
 
-        # After deleting all documents and history, delete the main employee folder (if exists and empty)
-        if drive_folder_id:
-            # Check if folder still has any files (documents might have been deleted above)
-            if is_folder_empty(drive_folder_id):
-                delete_drive_folder(drive_folder_id)
-            else:
-                print(f"Main folder {drive_folder_id} not empty, skipping deletion.")
-
         # Now delete the employee (cascades to documents via DB)
         db.session.delete(employee)
         db.session.commit()
+        forget_drive_folder(owner)
+
+        job = schedule_drive_cleanup(f'Deleted {employee.full_name}', url_for('admin_dashboard', tab='members'),
+                                     drive_file_ids, subfolder_ids, root_folder_ids)
+        if job:
+            session['generation_job_id'] = job.id
+            flash(f'Employee {employee.full_name} and all data deleted successfully! '
+                  f'Removing {len(drive_file_ids)} files from Google Drive in the background.', 'success')
+            return redirect(url_for('admin_dashboard', tab='members', cleanup_job=job.id))
 
         flash(f'Employee {employee.full_name} and all data deleted successfully!', 'success')
     except Exception as e:
@@ -2484,7 +4705,7 @@ def admin_generate_document(emp_id, doc_type):
     if doc_type == 'increment_letter':
         if request.method == 'GET':
             # Show the increment form
-            companies = Company.query.all()
+            companies = COMPANY_CACHE.all()
             return render_template('increment_form.html',
                                    employee=employee,
                                    companies=companies,
@@ -2495,7 +4716,7 @@ def admin_generate_document(emp_id, doc_type):
                 flash('Please select a company.', 'danger')
                 return redirect(url_for('admin_generate_document', emp_id=emp_id, doc_type=doc_type))
 
-            company = Company.query.get(company_id)
+            company = COMPANY_CACHE.get(company_id)
             if not company:
                 flash('Company not found.', 'danger')
                 return redirect(url_for('view_employee', emp_id=employee.id))
@@ -2591,7 +4812,7 @@ def admin_generate_document(emp_id, doc_type):
             flash('No company selected.', 'danger')
             return redirect(url_for('select_company_for_doc', emp_id=employee.id, doc_type=doc_type))
 
-        company = Company.query.get(company_id)
+        company = COMPANY_CACHE.get(company_id)
         if not company:
             flash('Company not found.', 'danger')
             return redirect(url_for('view_employee', emp_id=employee.id))
@@ -2667,9 +4888,9 @@ def admin_generate_document(emp_id, doc_type):
             company_id = request.form.get('company', type=int)
             if not company_id:
                 flash('Please select a company.', 'danger')
-                return render_template('select_months.html', employee=employee, companies=Company.query.all())
+                return render_template('select_months.html', employee=employee, companies=COMPANY_CACHE.all())
 
-            company = Company.query.get(company_id)
+            company = COMPANY_CACHE.get(company_id)
             if not company:
                 flash('Company not found.', 'danger')
                 return redirect(url_for('view_employee', emp_id=employee.id))
@@ -2692,7 +4913,7 @@ def admin_generate_document(emp_id, doc_type):
 
             if not selected_months:
                 flash('Please select at least one month.', 'danger')
-                return render_template('select_months.html', employee=employee, companies=Company.query.all())
+                return render_template('select_months.html', employee=employee, companies=COMPANY_CACHE.all())
 
             session['selected_months'] = selected_months
             session['selected_year'] = year
@@ -2756,7 +4977,7 @@ def admin_generate_document(emp_id, doc_type):
             return redirect(url_for('preview'))
 
         # GET request – show month selection form
-        return render_template('select_months.html', employee=employee, companies=Company.query.all())
+        return render_template('select_months.html', employee=employee, companies=COMPANY_CACHE.all())
 
     # ------------------------------------------------------------------
     # 5. ALL OTHER DOCUMENT TYPES (offer_letter, etc.)
@@ -2897,7 +5118,7 @@ def view_intern(intern_id):
     
     intern = Intern.query.get_or_404(intern_id)
     documents = InternDocument.query.filter_by(intern_id=intern.id).all()
-    company = Company.query.get(intern.company_id) if intern.company_id else None
+    company = COMPANY_CACHE.get(intern.company_id) if intern.company_id else None
     
     return render_template('view_intern.html', intern=intern, documents=documents, company=company)
 
@@ -2910,7 +5131,8 @@ def delete_intern(intern_id):
     
     try:
         # Delete associated documents first
-        InternDocument.query.filter_by(intern_id=intern.id).delete()
+        removed = InternDocument.query.filter_by(intern_id=intern.id).delete()
+        adjust_dashboard_counters(db.session.connection(), {'intern_documents': -removed})
         db.session.delete(intern)
         db.session.commit()
         flash(f'Intern {intern.full_name} deleted successfully', 'success')
@@ -3035,8 +5257,11 @@ def view_employee(emp_id):
     
     employee = Employee.query.get_or_404(emp_id)
     
-    # Explicitly query documents to ensure fresh data
-    documents = Document.query.filter_by(employee_id=emp_id).order_by(Document.generated_at.desc()).all()
+    # Explicitly query documents to ensure fresh data, one page at a time
+    documents, pagination = keyset_page(
+        Document.query.filter_by(employee_id=emp_id),
+        Document.generated_at, Document.id, app.config['DOCUMENTS_PER_PAGE']
+    )
     
     # Explicitly query increment history to ensure fresh data
     increment_history = IncrementHistory.query.filter_by(employee_id=emp_id).order_by(IncrementHistory.generated_at.desc()).all()
@@ -3051,10 +5276,38 @@ def view_employee(emp_id):
     return render_template('view_employee.html', 
                          employee=employee, 
                          documents=documents,
+                         pagination=pagination,
                          increment_history=increment_history,
                          latest_increment=latest_increment,
                          employee_folder=employee_folder)
 
+@app.route('/admin/api/employee/<int:emp_id>/documents')
+def api_employee_documents(emp_id):
+    """JSON page of an employee's documents, newest first; pass after/before cursors to page"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    employee = Employee.query.get_or_404(emp_id)
+    documents, page = keyset_page(
+        Document.query.filter_by(employee_id=employee.id),
+        Document.generated_at, Document.id, app.config['DOCUMENTS_PER_PAGE']
+    )
+    
+    return jsonify({
+        'documents': [{
+            'id': doc.id,
+            'document_type': doc.document_type,
+            'filename': doc.filename,
+            'month': doc.month,
+            'year': doc.year,
+            'drive_file_id': doc.drive_file_id,
+            'generated_by': doc.generated_by,
+            'generated_at': doc.generated_at.isoformat() if doc.generated_at else None,
+            'download_url': url_for('download_document', doc_id=doc.id),
+        } for doc in documents],
+        'page': page,
+    })
+
 def get_employee_folder_name(employee):
     """Generate folder name for employee documents"""
     return f"{employee.employee_id}_{employee.full_name.replace(' ', '_')}"
@@ -3107,6 +5360,8 @@ def add_employee():
                 designation=request.form['designation'],
                 department=request.form.get('department'),
                 base_ctc=float(request.form.get('ctc') or 0),
+                current_ctc=float(request.form.get('ctc') or 0),
+                total_monthly_increment=0,
                 joining_date=joining_date,
                 resignation_date=resignation_date,
                 status=request.form.get('status', 'active'),
@@ -3169,6 +5424,7 @@ def give_increment(emp_id):
     )
 
     db.session.add(history)
+    employee.refresh_ctc()
     db.session.commit()
 
     return redirect(url_for('view_employee', emp_id=emp_id))
@@ -3397,13 +5653,8 @@ def generate_resignation_acceptance(emp_id):
         # Upload to Google Drive if connected
         token_path = os.path.join(app.config['GOOGLE_DRIVE_TOKEN_FOLDER'], 'token.pickle')
         if os.path.exists(token_path):
-            try:
-                drive_file_id = upload_file_to_drive(file_path, filename, 'Resignation Letters', employee)
-                if drive_file_id:
-                    document.drive_file_id = drive_file_id
-                    db.session.commit()
-            except Exception as e:
-                print(f"Drive upload failed: {e}")
+            queue_drive_upload(document, 'Resignation Letters')
+            db.session.commit()
         
         flash(f'✅ Resignation acceptance letter generated successfully for {employee.full_name}!', 'success')
         return redirect(url_for('view_employee', emp_id=emp_id))
@@ -3428,7 +5679,7 @@ def save_resignation_details(emp_id):
         flash('Please select a company for the resignation letter.', 'danger')
         return redirect(url_for('view_employee', emp_id=emp_id))
 
-    company = Company.query.get(company_id)
+    company = COMPANY_CACHE.get(company_id)
     if not company:
         flash('Selected company does not exist.', 'danger')
         return redirect(url_for('view_employee', emp_id=emp_id))
@@ -3542,32 +5793,287 @@ def resignation_input_form(emp_id):
     if not session.get('is_admin'):
         return redirect(url_for('admin_login'))
     employee = Employee.query.get_or_404(emp_id)
-    companies = Company.query.all()
+    companies = COMPANY_CACHE.all()
     return render_template('resignation_input_form.html', employee=employee, companies=companies)
 
+# ========== GOOGLE DRIVE CLIENT ==========
+# The discovery-based Drive service is built once per process. httplib2 is not
+# thread-safe, so the service talks through a transport that hands each thread
+# its own AuthorizedHttp; the pickled token is re-read only when the file
+# changes and refreshed only once it has expired.
+app.config['GOOGLE_DRIVE_API_ENDPOINT'] = os.getenv('GOOGLE_DRIVE_API_ENDPOINT')  # e.g. a local fake Drive server
+
+class DriveNotConnected(Exception):
+    """No usable Google Drive token"""
+
+class ThreadLocalDriveHttp:
+    """httplib2-style transport that routes each thread to its own authorized connection"""
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    @property
+    def credentials(self):
+        # Batch requests read the credentials off the transport
+        return self._manager.credentials()
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        http = self._manager.thread_http()
+        if self._manager.api_endpoint:
+            # Media uploads keep the discovery document's https scheme; follow the endpoint's
+            endpoint = urlparse(self._manager.api_endpoint)
+            uri = urlparse(uri)._replace(scheme=endpoint.scheme, netloc=endpoint.netloc).geturl()
+        started = time.perf_counter()
+        failed = False
+        try:
+            return http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            self._manager.record_api_call(time.perf_counter() - started, failed)
+
+    def close(self):
+        self._manager.close_thread_http()
+
+class DriveClientManager:
+    """Process-wide Drive service with per-thread transports and lazily refreshed credentials"""
+
+    def __init__(self, token_path, api_endpoint=None):
+        self.token_path = token_path
+        self.api_endpoint = api_endpoint
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._service = None
+        self._credentials = None
+        self._token_mtime = None
+        self._stats = {'builds': 0, 'build_ms': 0.0, 'token_loads': 0, 'refreshes': 0, 'refresh_ms': 0.0,
+                       'transports': 0, 'api_calls': 0, 'api_errors': 0, 'api_ms': 0.0}
+
+    def _check_process(self):
+        # A forked worker must not share the parent's sockets
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._service = None
+            self._credentials = None
+            self._token_mtime = None
+            self._local = threading.local()
+
+    def credentials(self):
+        """The current credentials, reloaded if the token file changed and refreshed if expired"""
+        with self._lock:
+            self._check_process()
+            try:
+                mtime = os.path.getmtime(self.token_path)
+            except OSError:
+                self._credentials = None
+                self._token_mtime = None
+                raise DriveNotConnected("Not authenticated")
+
+            if self._credentials is None or mtime != self._token_mtime:
+                with open(self.token_path, 'rb') as token:
+                    self._credentials = pickle.load(token)
+                self._token_mtime = mtime
+                self._stats['token_loads'] += 1
+
+            credentials = self._credentials
+            if credentials.expired:
+                if not credentials.refresh_token:
+                    raise DriveNotConnected("Token expired. Please reconnect Google Drive.")
+                started = time.perf_counter()
+                credentials.refresh(Request())
+                # Save refreshed credentials
+                with open(self.token_path, 'wb') as token:
+                    pickle.dump(credentials, token)
+                self._token_mtime = os.path.getmtime(self.token_path)
+                self._stats['refreshes'] += 1
+                self._stats['refresh_ms'] += (time.perf_counter() - started) * 1000
+            return credentials
+
+    def thread_http(self):
+        """This thread's authorized transport, rebuilt when the credentials are replaced"""
+        credentials = self.credentials()
+        local = self._local
+        if getattr(local, 'credentials', None) is not credentials:
+            self.close_thread_http()
+            local.http = AuthorizedHttp(credentials, http=build_http())
+            local.credentials = credentials
+            with self._lock:
+                self._stats['transports'] += 1
+        return local.http
+
+    def close_thread_http(self):
+        http = getattr(self._local, 'http', None)
+        if http is not None:
+            http.close()
+        self._local.http = None
+        self._local.credentials = None
+
+    def service(self):
+        """The shared Drive v3 service; raises DriveNotConnected without a usable token"""
+        self.credentials()
+        with self._lock:
+            if self._service is None:
+                started = time.perf_counter()
+                client_options = {'api_endpoint': self.api_endpoint} if self.api_endpoint else None
+                self._service = build('drive', 'v3', http=ThreadLocalDriveHttp(self), static_discovery=True,
+                                      cache_discovery=False, client_options=client_options)
+                self._stats['builds'] += 1
+                self._stats['build_ms'] += (time.perf_counter() - started) * 1000
+            return self._service
+
+    def record_api_call(self, seconds, failed=False):
+        with self._lock:
+            self._stats['api_calls'] += 1
+            self._stats['api_ms'] += seconds * 1000
+            if failed:
+                self._stats['api_errors'] += 1
+
+    def invalidate(self):
+        """Forget the loaded token, e.g. after connecting or disconnecting Drive"""
+        with self._lock:
+            self._credentials = None
+            self._token_mtime = None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        for key in ('build_ms', 'refresh_ms', 'api_ms'):
+            stats[key] = round(stats[key], 3)
+        stats['api_avg_ms'] = round(stats['api_ms'] / stats['api_calls'], 3) if stats['api_calls'] else 0.0
+        stats['built'] = self._service is not None
+        return stats
+
+DRIVE_CLIENT = DriveClientManager(os.path.join(app.config['GOOGLE_DRIVE_TOKEN_FOLDER'], 'token.pickle'),
+                                  api_endpoint=app.config['GOOGLE_DRIVE_API_ENDPOINT'])
+
 def get_drive_service():
-    """Get authenticated Google Drive service"""
-    token_path = os.path.join(app.config['GOOGLE_DRIVE_TOKEN_FOLDER'], 'token.pickle')
-    
-    if not os.path.exists(token_path):
-        return None, "Not authenticated"
-    
-    with open(token_path, 'rb') as token:
-        credentials = pickle.load(token)
-    
-    # Refresh token if expired
-    if credentials.expired and credentials.refresh_token:
-        request = Request()
-        credentials.refresh(request)
-        
-        # Save refreshed credentials
-        with open(token_path, 'wb') as token:
-            pickle.dump(credentials, token)
-    elif credentials.expired:
-        return None, "Token expired. Please reconnect Google Drive."
-    
-    service = build('drive', 'v3', credentials=credentials)
-    return service, None
+    """Get the shared, authenticated Google Drive service"""
+    try:
+        return DRIVE_CLIENT.service(), None
+    except DriveNotConnected as e:
+        return None, str(e)
+
+# ========== DRIVE FOLDER MAP ==========
+# Folder IDs are remembered in drive_folder so an upload is usually a single
+# files().create. Cached entries are re-checked at most every
+# DRIVE_FOLDER_VERIFY_AFTER seconds, and a folder that turns out to be trashed
+# or deleted is dropped and looked up (or created) again.
+app.config['DRIVE_FOLDER_VERIFY_AFTER'] = int(os.getenv('DRIVE_FOLDER_VERIFY_AFTER', 86400))
+DRIVE_FOLDER_MIME = 'application/vnd.google-apps.folder'
+_drive_folder_lock = threading.Lock()
+
+def drive_owner_folder_name(employee=None):
+    """Name of the employee's top-level Drive folder"""
+    if not employee:
+        return "Documents"
+    return f"{employee.employee_id}_{employee.full_name.replace(' ', '_')}"
+
+def find_or_create_drive_folder(service, name, parent_id=None):
+    """ID of the untrashed folder called `name` (under parent_id), creating it if missing"""
+    escaped = name.replace("'", "\\'")
+    query = f"name='{escaped}' and mimeType='{DRIVE_FOLDER_MIME}' and trashed=false"
+    if parent_id:
+        query += f" and '{parent_id}' in parents"
+    response = service.files().list(q=query, spaces='drive', fields='files(id, name)').execute()
+    folders = response.get('files', [])
+    if folders:
+        return folders[0]['id']
+
+    file_metadata = {'name': name, 'mimeType': DRIVE_FOLDER_MIME}
+    if parent_id:
+        file_metadata['parents'] = [parent_id]
+    return service.files().create(body=file_metadata, fields='id').execute().get('id')
+
+def drive_folder_is_live(service, folder_id):
+    """True unless Drive says the folder is trashed or gone"""
+    try:
+        folder = service.files().get(fileId=folder_id, fields='id, trashed').execute()
+    except HttpError as e:
+        if e.resp.status == 404:
+            return False
+        raise
+    return not folder.get('trashed')
+
+def forget_drive_folder(owner, path=''):
+    """Drop a cached folder; dropping the owner's folder also drops its subfolders"""
+    query = DriveFolder.query.filter(DriveFolder.owner == owner)
+    if path:
+        query = query.filter(DriveFolder.path == path)
+    query.delete(synchronize_session=False)
+    db.session.commit()
+
+def remember_drive_folder(owner, path, folder_id):
+    try:
+        db.session.add(DriveFolder(owner=owner, path=path, folder_id=folder_id, verified_at=datetime.now()))
+        db.session.commit()
+    except IntegrityError:
+        # Another process mapped it first; keep theirs
+        db.session.rollback()
+        existing = DriveFolder.query.filter_by(owner=owner, path=path).first()
+        if existing:
+            return existing.folder_id
+    return folder_id
+
+def resolve_drive_folder(service, owner, path='', known_id=None):
+    """
+    Drive ID of the owner's folder, or of its `path` subfolder, from the folder map
+    when possible. known_id seeds the map for an owner folder stored elsewhere.
+    """
+    entry = DriveFolder.query.filter_by(owner=owner, path=path).first()
+    if entry is None and known_id and not path:
+        entry = DriveFolder(owner=owner, path='', folder_id=known_id)
+        db.session.add(entry)
+        db.session.commit()
+
+    if entry is not None:
+        max_age = timedelta(seconds=app.config['DRIVE_FOLDER_VERIFY_AFTER'])
+        if entry.verified_at and datetime.now() - entry.verified_at < max_age:
+            return entry.folder_id
+        if drive_folder_is_live(service, entry.folder_id):
+            entry.verified_at = datetime.now()
+            db.session.commit()
+            return entry.folder_id
+        print(f"♻️ Drive folder {owner}/{path} ({entry.folder_id}) is trashed or gone, looking it up again")
+        forget_drive_folder(owner, path)
+
+    parent_id = resolve_drive_folder(service, owner) if path else None
+    # Serialize misses so parallel uploads don't create the same folder twice
+    with _drive_folder_lock:
+        entry = DriveFolder.query.filter_by(owner=owner, path=path).first()
+        if entry is not None:
+            return entry.folder_id
+        folder_id = find_or_create_drive_folder(service, path or owner, parent_id)
+        return remember_drive_folder(owner, path, folder_id)
+
+def upload_to_drive_folder(service, file_path, filename, owner, path=''):
+    """Upload a PDF into the owner's `path` folder, repairing the folder map once if it is stale"""
+    for attempt in range(2):
+        target_folder_id = resolve_drive_folder(service, owner, path)
+        media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
+        try:
+            file = service.files().create(
+                body={'name': filename, 'parents': [target_folder_id]},
+                media_body=media,
+                fields='id'
+            ).execute()
+            return file.get('id')
+        except HttpError as e:
+            if attempt or e.resp.status != 404:
+                raise
+            print(f"♻️ Drive folder {target_folder_id} disappeared during upload, looking it up again")
+            forget_drive_folder(owner, path)
+
+def get_employee_drive_folder(service, employee=None):
+    """Find or create the employee's top-level Drive folder and return its ID"""
+    known_id = employee.drive_folder_id if isinstance(employee, Employee) else None
+    parent_folder_id = resolve_drive_folder(service, drive_owner_folder_name(employee), known_id=known_id)
+    # Save folder ID to employee record
+    if isinstance(employee, Employee) and employee.drive_folder_id != parent_folder_id:
+        employee.drive_folder_id = parent_folder_id
+        db.session.commit()
+    return parent_folder_id
 
 def upload_file_to_drive(file_path, filename, folder_name=None, employee=None):
     """Upload file to Google Drive"""
@@ -3576,68 +6082,9 @@ def upload_file_to_drive(file_path, filename, folder_name=None, employee=None):
         raise Exception(f"Google Drive not connected: {error}")
     
     try:
-        # Use employee details for folder name
-        emp_id = employee.employee_id if employee else "unknown"
-        emp_name = employee.full_name if employee else "Unknown"
-        main_folder_name = f"{emp_id}_{emp_name.replace(' ', '_')}" if employee else "Documents"
-        
         # Create or get main employee folder
-        response = service.files().list(
-            q=f"name='{main_folder_name}' and mimeType='application/vnd.google-apps.folder' and trashed=false",
-            spaces='drive',
-            fields='files(id, name)'
-        ).execute()
-        folders = response.get('files', [])
-        
-        if folders:
-            parent_folder_id = folders[0]['id']
-        else:
-            file_metadata = {
-                'name': main_folder_name,
-                'mimeType': 'application/vnd.google-apps.folder'
-            }
-            folder = service.files().create(body=file_metadata, fields='id').execute()
-            parent_folder_id = folder.get('id')
-            # Save folder ID to employee record
-            if employee:
-                employee.drive_folder_id = parent_folder_id
-                db.session.commit()
-        
-        # Create subfolder if specified
-        if folder_name:
-            response = service.files().list(
-                q=f"name='{folder_name}' and '{parent_folder_id}' in parents and mimeType='application/vnd.google-apps.folder' and trashed=false",
-                spaces='drive',
-                fields='files(id, name)'
-            ).execute()
-            subfolders = response.get('files', [])
-            
-            if subfolders:
-                target_folder_id = subfolders[0]['id']
-            else:
-                file_metadata = {
-                    'name': folder_name,
-                    'mimeType': 'application/vnd.google-apps.folder',
-                    'parents': [parent_folder_id]
-                }
-                subfolder = service.files().create(body=file_metadata, fields='id').execute()
-                target_folder_id = subfolder.get('id')
-        else:
-            target_folder_id = parent_folder_id
-        
-        # Upload file
-        file_metadata = {
-            'name': filename,
-            'parents': [target_folder_id]
-        }
-        media = MediaFileUpload(file_path, mimetype='application/pdf', resumable=True)
-        file = service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
-        file_id = file.get('id')
-        return file_id
+        get_employee_drive_folder(service, employee)
+        return upload_to_drive_folder(service, file_path, filename, drive_owner_folder_name(employee), folder_name or '')
         
     except Exception as e:
         import traceback
@@ -3645,59 +6092,436 @@ def upload_file_to_drive(file_path, filename, folder_name=None, employee=None):
         traceback.print_exc()
         raise Exception(f"Drive upload failed: {str(e)}")
 
-def delete_drive_file(file_id):
-    """Delete a file from Google Drive by its ID."""
-    service, error = get_drive_service()
-    if error:
-        print(f"Drive service error: {error}")
-        return False
-    try:
-        service.files().delete(fileId=file_id).execute()
-        print(f"Deleted Drive file {file_id}")
-        return True
-    except Exception as e:
-        print(f"Error deleting Drive file {file_id}: {e}")
-        return False
+# ========== DRIVE UPLOAD OUTBOX ==========
+# Generation commits a drive_upload row next to each document that should go
+# to Drive and returns as soon as the PDF is on disk. Worker threads in each
+# app process claim due rows, upload them and store the Drive ID on the
+# document. Rate limits (429, 403 rateLimitExceeded), 5xx and network or auth
+# errors are retried with jittered exponential backoff; other API errors and
+# rows out of attempts are dead-lettered for /admin/drive-outbox to retry.
+app.config['DRIVE_OUTBOX_WORKERS'] = int(os.getenv('DRIVE_OUTBOX_WORKERS', 2))  # 0 = drain with `flask drain-drive-outbox`
+app.config['DRIVE_OUTBOX_POLL_INTERVAL'] = float(os.getenv('DRIVE_OUTBOX_POLL_INTERVAL', 5))
+app.config['DRIVE_OUTBOX_MAX_ATTEMPTS'] = int(os.getenv('DRIVE_OUTBOX_MAX_ATTEMPTS', 8))
+app.config['DRIVE_OUTBOX_BACKOFF_BASE'] = float(os.getenv('DRIVE_OUTBOX_BACKOFF_BASE', 30))     # seconds
+app.config['DRIVE_OUTBOX_BACKOFF_MAX'] = float(os.getenv('DRIVE_OUTBOX_BACKOFF_MAX', 3600))    # seconds
+app.config['DRIVE_OUTBOX_STALE_AFTER'] = int(os.getenv('DRIVE_OUTBOX_STALE_AFTER', 600))
+app.config['DRIVE_OUTBOX_RETENTION_DAYS'] = int(os.getenv('DRIVE_OUTBOX_RETENTION_DAYS', 7))
+
+DRIVE_OUTBOX_STATS = {'uploaded': 0, 'retried': 0, 'dead': 0, 'upload_ms': 0.0}
+_drive_outbox_stats_lock = threading.Lock()
+_drive_outbox_wakeup = threading.Event()
+_drive_outbox_workers = {'pid': None, 'threads': []}
+_drive_outbox_workers_lock = threading.Lock()
+DRIVE_RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+
+def queue_drive_upload(document, folder=''):
+    """Add an outbox row for a Document or InternDocument; it is uploaded once the session commits"""
+    if document.id is None:
+        db.session.flush()
+    kind = 'intern' if isinstance(document, InternDocument) else 'employee'
+    db.session.add(DriveUpload(document_kind=kind, document_id=document.id, folder=folder or ''))
+    db.session.info['drive_uploads_queued'] = True
+
+
+def queue_drive_uploads(kind, document_ids, folder=''):
+    """Bulk version of queue_drive_upload() for documents inserted without ORM objects"""
+    if not document_ids:
+        return
+    db.session.execute(db.insert(DriveUpload), [
+        {'document_kind': kind, 'document_id': document_id, 'folder': folder or ''}
+        for document_id in document_ids
+    ])
+    db.session.info['drive_uploads_queued'] = True
+
+
+@event.listens_for(OrmSession, 'after_commit')
+def _wake_drive_outbox(session):
+    if session.info.pop('drive_uploads_queued', False):
+        start_drive_outbox_workers()
+        _drive_outbox_wakeup.set()
+
+
+def _update_drive_upload(upload_id, expected_status=None, **values):
+    """Write outbox state on its own connection, like _update_generation_job()"""
+    table = DriveUpload.__table__
+    query = table.update().where(table.c.id == upload_id)
+    if expected_status:
+        query = query.where(table.c.status == expected_status)
+    with db.engine.begin() as conn:
+        return conn.execute(query.values(**values)).rowcount
+
+
+def claim_drive_upload(worker_name):
+    """Move the oldest due pending upload to uploading; returns its id, or None if nothing was claimed"""
+    table = DriveUpload.__table__
+    now = datetime.now()
+    with db.engine.begin() as conn:
+        upload_id = conn.execute(
+            db.select(table.c.id)
+            .where(table.c.status == 'pending', table.c.next_attempt_at <= now)
+            .order_by(table.c.next_attempt_at, table.c.id)
+            .limit(1)
+        ).scalar()
+        if not upload_id:
+            return None
+        # The status guard makes the claim atomic across threads and processes
+        claimed = conn.execute(
+            table.update()
+            .where(table.c.id == upload_id, table.c.status == 'pending')
+            .values(status='uploading', worker=worker_name, attempts=table.c.attempts + 1, started_at=now)
+        ).rowcount
+    return upload_id if claimed else None
+
+
+def maintain_drive_outbox():
+    """Requeue uploads whose worker died and prune old finished rows"""
+    table = DriveUpload.__table__
+    now = datetime.now()
+    with db.engine.begin() as conn:
+        requeued = conn.execute(
+            table.update()
+            .where(table.c.status == 'uploading',
+                   table.c.started_at < now - timedelta(seconds=app.config['DRIVE_OUTBOX_STALE_AFTER']))
+            .values(status='pending', worker=None, next_attempt_at=now)
+        ).rowcount
+        conn.execute(
+            table.delete().where(
+                table.c.status == 'done',
+                table.c.finished_at < now - timedelta(days=app.config['DRIVE_OUTBOX_RETENTION_DAYS'])
+            )
+        )
+    if requeued:
+        print(f"♻️ Stale Drive uploads requeued: {requeued}")
+
+
+def drive_upload_retryable(error):
+    """Rate limits, server errors and transport/auth failures are worth retrying"""
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or status >= 500:
+            return True
+        return status == 403 and any(reason in str(error.content) for reason in DRIVE_RATE_LIMIT_REASONS)
+    return True
 
-def get_parent_folder_id(file_id):
-    """Return the ID of the parent folder of a given file."""
-    service, error = get_drive_service()
-    if error:
-        return None
-    try:
-        file = service.files().get(fileId=file_id, fields='parents').execute()
-        parents = file.get('parents', [])
-        return parents[0] if parents else None
-    except Exception as e:
-        print(f"Error getting parent for {file_id}: {e}")
-        return None
 
-def is_folder_empty(folder_id):
-    """Check if a Drive folder has any files/folders inside (excluding trashed)."""
+def drive_upload_backoff(attempts):
+    """Exponential backoff with jitter: half the capped delay plus a random share of the other half"""
+    delay = min(app.config['DRIVE_OUTBOX_BACKOFF_MAX'],
+                app.config['DRIVE_OUTBOX_BACKOFF_BASE'] * 2 ** max(attempts - 1, 0))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _record_drive_outbox(key, amount=1):
+    with _drive_outbox_stats_lock:
+        DRIVE_OUTBOX_STATS[key] += amount
+
+
+def _upload_outbox_document(upload):
+    """Upload one outbox row's document; returns the Drive file ID"""
+    model = InternDocument if upload.document_kind == 'intern' else Document
+    document = db.session.get(model, upload.document_id)
+    if document is None:
+        raise LookupError('Document was deleted')
+    if document.drive_file_id:
+        return document.drive_file_id
+    if not document.file_path or not os.path.exists(document.file_path):
+        raise LookupError(f'Local file is missing: {document.file_path}')
+
     service, error = get_drive_service()
     if error:
-        return False
-    try:
-        query = f"'{folder_id}' in parents and trashed=false"
-        response = service.files().list(q=query, fields='files(id)').execute()
-        files = response.get('files', [])
-        return len(files) == 0
-    except Exception as e:
-        print(f"Error checking folder {folder_id}: {e}")
-        return False
+        raise DriveNotConnected(error)
+    if upload.document_kind == 'intern':
+        intern = document.intern
+        owner = f"{intern.intern_id}_{intern.full_name.replace(' ', '_')}"
+    else:
+        get_employee_drive_folder(service, document.employee)
+        owner = drive_owner_folder_name(document.employee)
+
+    file_id = upload_to_drive_folder(service, document.file_path, document.filename, owner, upload.folder)
+    document.drive_file_id = file_id
+    db.session.commit()
+    return file_id
+
+
+def execute_drive_upload(upload_id, worker_name=None):
+    """Run a claimed upload and record the outcome: done, pending again with backoff, or dead"""
+    with app.app_context():
+        upload = db.session.get(DriveUpload, upload_id)
+        started = time.perf_counter()
+        try:
+            file_id = _upload_outbox_document(upload)
+        except Exception as e:
+            db.session.rollback()
+            attempts = upload.attempts or 0
+            retry = (not isinstance(e, LookupError) and drive_upload_retryable(e)
+                     and attempts < app.config['DRIVE_OUTBOX_MAX_ATTEMPTS'])
+            if retry:
+                delay = drive_upload_backoff(attempts)
+                _record_drive_outbox('retried')
+                print(f"⚠️ Drive upload {upload_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {e}")
+                _update_drive_upload(upload_id, expected_status='uploading', status='pending', worker=None,
+                                     last_error=str(e), next_attempt_at=datetime.now() + timedelta(seconds=delay))
+            else:
+                _record_drive_outbox('dead')
+                print(f"❌ Drive upload {upload_id} dead-lettered after {attempts} attempts: {e}")
+                _update_drive_upload(upload_id, expected_status='uploading', status='dead',
+                                     last_error=str(e), finished_at=datetime.now())
+            return False
+
+        _record_drive_outbox('uploaded')
+        _record_drive_outbox('upload_ms', (time.perf_counter() - started) * 1000)
+        _update_drive_upload(upload_id, expected_status='uploading', status='done', last_error=None,
+                             drive_file_id=file_id, finished_at=datetime.now())
+    print(f"✅ Drive upload {upload_id} done ({worker_name or 'inline'})")
+    return True
+
+
+def drain_drive_outbox(worker_name='drain', limit=None):
+    """Upload due rows until none are left (or `limit` were handled); returns how many were handled"""
+    handled = 0
+    while limit is None or handled < limit:
+        with app.app_context():
+            upload_id = claim_drive_upload(worker_name)
+        if not upload_id:
+            break
+        execute_drive_upload(upload_id, worker_name)
+        handled += 1
+    return handled
+
+
+def _drive_outbox_worker_loop(worker_name):
+    while True:
+        try:
+            with app.app_context():
+                maintain_drive_outbox()
+                upload_id = claim_drive_upload(worker_name)
+            if upload_id:
+                execute_drive_upload(upload_id, worker_name)
+                continue
+        except Exception as e:
+            print(f"⚠️ Drive outbox worker {worker_name} error: {e}")
+        _drive_outbox_wakeup.wait(app.config['DRIVE_OUTBOX_POLL_INTERVAL'])
+        _drive_outbox_wakeup.clear()
+
+
+def start_drive_outbox_workers():
+    """Start this process's upload threads once; forked processes start their own"""
+    if app.config['DRIVE_OUTBOX_WORKERS'] <= 0:
+        return
+    with _drive_outbox_workers_lock:
+        if _drive_outbox_workers['pid'] == os.getpid():
+            return
+        _drive_outbox_workers['pid'] = os.getpid()
+        _drive_outbox_workers['threads'] = []
+        for i in range(app.config['DRIVE_OUTBOX_WORKERS']):
+            worker_name = f"{os.getpid()}-{i}"
+            thread = threading.Thread(
+                target=_drive_outbox_worker_loop, args=(worker_name,),
+                name=f"drive-outbox-{worker_name}", daemon=True
+            )
+            thread.start()
+            _drive_outbox_workers['threads'].append(thread)
+        print(f"✅ Started {app.config['DRIVE_OUTBOX_WORKERS']} Drive upload workers in process {os.getpid()}")
+
+
+@app.before_request
+def ensure_drive_outbox_workers():
+    # Picks up uploads queued before a restart as soon as the process serves traffic
+    start_drive_outbox_workers()
+
+
+def drive_outbox_status():
+    """Backlog by status, age of the oldest pending row and recent upload throughput"""
+    table = DriveUpload.__table__
+    now = datetime.now()
+    counts = dict(db.session.execute(
+        db.select(table.c.status, db.func.count()).group_by(table.c.status)
+    ).all())
+    oldest = db.session.execute(
+        db.select(db.func.min(table.c.created_at)).where(table.c.status.in_(('pending', 'uploading')))
+    ).scalar()
+    recent = {
+        label: db.session.execute(
+            db.select(db.func.count()).where(table.c.status == 'done', table.c.finished_at >= now - window)
+        ).scalar()
+        for label, window in (('last_15_min', timedelta(minutes=15)), ('last_hour', timedelta(hours=1)))
+    }
+    with _drive_outbox_stats_lock:
+        process = dict(DRIVE_OUTBOX_STATS)
+    process['upload_avg_ms'] = round(process['upload_ms'] / process['uploaded'], 3) if process['uploaded'] else 0.0
+    process['upload_ms'] = round(process['upload_ms'], 3)
+    return {
+        'backlog': counts.get('pending', 0) + counts.get('uploading', 0),
+        'counts': {status: counts.get(status, 0) for status in ('pending', 'uploading', 'done', 'dead')},
+        'oldest_pending_seconds': round((now - oldest).total_seconds()) if oldest else 0,
+        'uploaded': recent,
+        'uploads_per_minute': round(recent['last_15_min'] / 15, 2),
+        'workers': app.config['DRIVE_OUTBOX_WORKERS'],
+        'process': process,
+    }
+
+
+@app.route('/admin/drive-outbox')
+def drive_outbox():
+    """Drive upload backlog, throughput and the latest dead letters (JSON)"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    dead = (DriveUpload.query.filter_by(status='dead')
+            .order_by(DriveUpload.finished_at.desc()).limit(20).all())
+    return jsonify(dict(drive_outbox_status(), dead_letters=[upload.to_dict() for upload in dead]))
+
 
-def delete_drive_folder(folder_id):
-    """Delete a Drive folder by its ID (folder must be empty)."""
+@app.route('/admin/drive-outbox/retry', methods=['POST'])
+def retry_drive_outbox():
+    """Put dead-lettered uploads (all, or the posted ids) back in the queue"""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    table = DriveUpload.__table__
+    query = table.update().where(table.c.status == 'dead')
+    ids = request.form.getlist('id', type=int)
+    if ids:
+        query = query.where(table.c.id.in_(ids))
+    with db.engine.begin() as conn:
+        requeued = conn.execute(
+            query.values(status='pending', attempts=0, worker=None, finished_at=None, next_attempt_at=datetime.now())
+        ).rowcount
+    start_drive_outbox_workers()
+    _drive_outbox_wakeup.set()
+    return jsonify({'requeued': requeued})
+
+
+@app.cli.command('drain-drive-outbox')
+@click.option('--limit', type=int, help='Stop after this many uploads')
+def drain_drive_outbox_command(limit):
+    """Upload every due row in the Drive outbox from this process"""
+    with app.app_context():
+        maintain_drive_outbox()
+    handled = drain_drive_outbox(limit=limit)
+    print(f"✅ Handled {handled} Drive uploads")
+    with app.app_context():
+        print(drive_outbox_status())
+
+# ========== DRIVE CLEANUP ==========
+# Deleting an employee or a document removes its Drive files in batches of up
+# to DRIVE_BATCH_SIZE calls per round-trip: look up every file's parent, delete
+# the files, then check each distinct folder once and remove the empty ones.
+# With background workers the cleanup runs as a generation job
+# (kind 'drive_cleanup') so the delete returns at once and /jobs/<id> reports
+# its progress.
+app.config['DRIVE_BATCH_SIZE'] = min(100, int(os.getenv('DRIVE_BATCH_SIZE', 100)))  # Drive caps batches at 100
+
+def drive_batch(service, requests, callback):
+    """
+    Execute (request_id, HttpRequest) pairs in batches of DRIVE_BATCH_SIZE,
+    calling callback(request_id, response, exception) for each.
+    """
+    requests = list(requests)
+    size = max(1, app.config['DRIVE_BATCH_SIZE'])
+    for start in range(0, len(requests), size):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, drive_request in requests[start:start + size]:
+            batch.add(drive_request, request_id=request_id)
+        batch.execute()
+
+def _drive_not_found(exception):
+    return isinstance(exception, HttpError) and exception.resp.status == 404
+
+def delete_drive_files_batched(service, file_ids, folder_ids=(), root_folder_ids=(), progress=None):
+    """
+    Delete file_ids from Drive, then remove whichever of their parent folders,
+    folder_ids and finally root_folder_ids are left empty.
+    Returns {'files': deleted, 'folders': deleted, 'failed': [ids]}.
+    """
+    report = progress or (lambda done, total, message=None: None)
+    file_ids = list(dict.fromkeys(file_ids))
+    root_folder_ids = [folder_id for folder_id in dict.fromkeys(root_folder_ids) if folder_id]
+    outcome = {'files': 0, 'folders': 0, 'failed': []}
+
+    # Parents have to be read before the files are gone
+    parents = dict.fromkeys(folder_id for folder_id in folder_ids if folder_id)
+    def parent_found(request_id, response, exception):
+        if exception is None:
+            parents.update(dict.fromkeys(response.get('parents', [])))
+    drive_batch(service, [(file_id, service.files().get(fileId=file_id, fields='parents'))
+                          for file_id in file_ids], parent_found)
+    total = len(file_ids) + len(parents) + len(root_folder_ids)
+    report(0, total, f'Deleting {len(file_ids)} Drive files')
+
+    def deleted(kind):
+        def callback(request_id, response, exception):
+            if exception is None or _drive_not_found(exception):
+                outcome[kind] += 1
+            else:
+                print(f"Error deleting Drive {kind[:-1]} {request_id}: {exception}")
+                outcome['failed'].append(request_id)
+        return callback
+    drive_batch(service, [(file_id, service.files().delete(fileId=file_id)) for file_id in file_ids],
+                deleted('files'))
+    done = len(file_ids)
+    report(done, total, f"Deleted {outcome['files']} Drive files")
+
+    # Subfolders first so the owner's own folder can be empty by the time it is checked
+    for folders in ([folder_id for folder_id in parents if folder_id not in root_folder_ids], root_folder_ids):
+        empty = []
+        def listed(request_id, response, exception):
+            if exception is None and not response.get('files'):
+                empty.append(request_id)
+        drive_batch(service, [
+            (folder_id, service.files().list(q=f"'{folder_id}' in parents and trashed=false",
+                                             fields='files(id)', pageSize=1))
+            for folder_id in folders
+        ], listed)
+        drive_batch(service, [(folder_id, service.files().delete(fileId=folder_id)) for folder_id in empty],
+                    deleted('folders'))
+        done += len(folders)
+        report(done, total, f"Removed {outcome['folders']} empty folders")
+    return outcome
+
+def run_drive_cleanup(payload, progress=None):
+    """Generation-job runner for delete_drive_files_batched(); returns a generation_result() dict"""
+    redirect_url = payload.get('redirect') or url_for('admin_dashboard')
+    label = payload.get('label') or 'Drive cleanup'
     service, error = get_drive_service()
     if error:
-        return False
+        return dict(generation_result(f'{label}: Google Drive not connected ({error}), Drive files were left in place',
+                                      redirect_url, 'warning'), clears_preview=False)
+
+    started = time.time()
+    outcome = delete_drive_files_batched(service, payload.get('file_ids') or [], payload.get('folder_ids') or [],
+                                         payload.get('root_folder_ids') or [], progress)
+    print(f"✅ {label}: {outcome['files']} files and {outcome['folders']} folders removed from Drive "
+          f"in {time.time() - started:.1f}s, {len(outcome['failed'])} failed")
+    message = f"{label}: removed {outcome['files']} files and {outcome['folders']} folders from Google Drive"
+    if outcome['failed']:
+        message += f"; {len(outcome['failed'])} could not be deleted"
+    result = generation_result(message, redirect_url, 'warning' if outcome['failed'] else 'success')
+    result.update({'clears_preview': False, 'drive': outcome})
+    return result
+
+def schedule_drive_cleanup(label, redirect_url, file_ids, folder_ids=(), root_folder_ids=()):
+    """Queue a Drive cleanup job (or run it now without workers); returns the job or None"""
+    file_ids = [file_id for file_id in file_ids if file_id]
+    if not file_ids and not any(folder_ids) and not any(root_folder_ids):
+        return None
+    payload = {
+        'kind': 'drive_cleanup',
+        'label': label,
+        'redirect': redirect_url,
+        'file_ids': file_ids,
+        'folder_ids': [folder_id for folder_id in folder_ids if folder_id],
+        'root_folder_ids': [folder_id for folder_id in root_folder_ids if folder_id],
+        'admin_username': session.get('admin_username'),
+        'base_url': request.url_root,
+    }
+    if app.config['GENERATION_WORKERS'] > 0:
+        return enqueue_generation_job(payload, document_type='drive_cleanup')
     try:
-        service.files().delete(fileId=folder_id).execute()
-        print(f"Deleted Drive folder {folder_id}")
-        return True
+        result = run_drive_cleanup(payload)
+        print(result['message'])
     except Exception as e:
-        print(f"Error deleting folder {folder_id}: {e}")
-        return False
+        print(f"Drive cleanup error (continuing anyway): {e}")
+    return None
 
 # ==================== GOOGLE DRIVE AUTHENTICATION ROUTES ====================
 
@@ -3769,6 +6593,7 @@ def oauth2callback():
         
         with open(token_path, 'wb') as token:
             pickle.dump(credentials, token)
+        DRIVE_CLIENT.invalidate()
         
         # Clear session state
         session.pop('oauth_state', None)
@@ -3792,6 +6617,7 @@ def disconnect_drive():
     token_path = os.path.join(app.config['GOOGLE_DRIVE_TOKEN_FOLDER'], 'token.pickle')
     if os.path.exists(token_path):
         os.remove(token_path)
+        DRIVE_CLIENT.invalidate()
         flash('Disconnected from Google Drive', 'success')
     else:
         flash('No Google Drive connection found', 'info')
@@ -3830,7 +6656,7 @@ def utility_processor():
 def admin_companies():
     if not session.get('is_admin'):
         return redirect(url_for('admin_login'))
-    companies = Company.query.all()
+    companies = COMPANY_CACHE.all()
     return render_template('admin_companies.html', companies=companies)
 
 @app.route('/admin/companies/add', methods=['GET', 'POST'])
@@ -3850,18 +6676,15 @@ def add_company():
 
         # Save logo (for watermark)
         if logo_file and logo_file.filename:
-            logo_filename = secure_filename(logo_file.filename)
-            logo_file.save(os.path.join(app.root_path, 'static', 'images', logo_filename))
+            logo_filename = save_company_upload(logo_file, 'logo')
         
         # Save logo with name (for header)
         if logo_with_name_file and logo_with_name_file.filename:
-            logo_with_name_filename = secure_filename(logo_with_name_file.filename)
-            logo_with_name_file.save(os.path.join(app.root_path, 'static', 'images', logo_with_name_filename))
+            logo_with_name_filename = save_company_upload(logo_with_name_file, 'logo_with_name')
         
         # Save signature
         if signature_file and signature_file.filename:
-            signature_filename = secure_filename(signature_file.filename)
-            signature_file.save(os.path.join(app.root_path, 'static', 'images', 'signatures', signature_filename))
+            signature_filename = save_company_upload(signature_file, 'signature')
 
         company = Company(
             name=request.form['name'],
@@ -3880,6 +6703,7 @@ def add_company():
         )
         db.session.add(company)
         db.session.commit()
+        COMPANY_CACHE.invalidate()
         flash('Company added successfully', 'success')
         return redirect(url_for('admin_companies'))
     
@@ -3904,28 +6728,32 @@ def edit_company(company_id):
         company.notice_period = request.form.get('notice_period')
         company.email_domain = request.form.get('email_domain')
 
+        # Uploads replaced below; their print variants are removed once the new ones are saved
+        replaced = []
+
         # Handle logo upload (for watermark)
         logo_file = request.files.get('logo')
         if logo_file and logo_file.filename:
-            logo_filename = secure_filename(logo_file.filename)
-            logo_file.save(os.path.join(app.root_path, 'static', 'images', logo_filename))
-            company.logo = logo_filename
+            replaced.append((company.logo, 'logo'))
+            company.logo = save_company_upload(logo_file, 'logo')
 
         # Handle logo with name upload (NEW)
         logo_with_name_file = request.files.get('logo_with_name')
         if logo_with_name_file and logo_with_name_file.filename:
-            logo_with_name_filename = secure_filename(logo_with_name_file.filename)
-            logo_with_name_file.save(os.path.join(app.root_path, 'static', 'images', logo_with_name_filename))
-            company.logo_with_name = logo_with_name_filename
+            replaced.append((company.logo_with_name, 'logo_with_name'))
+            company.logo_with_name = save_company_upload(logo_with_name_file, 'logo_with_name')
 
         # Handle signature upload
         signature_file = request.files.get('signature')
         if signature_file and signature_file.filename:
-            signature_filename = secure_filename(signature_file.filename)
-            signature_file.save(os.path.join(app.root_path, 'static', 'images', 'signatures', signature_filename))
-            company.signature = signature_filename
+            replaced.append((company.signature, 'signature'))
+            company.signature = save_company_upload(signature_file, 'signature')
 
         db.session.commit()
+        for old_filename, field in replaced:
+            if old_filename:
+                remove_replaced_company_asset_variants(old_filename, field)
+        COMPANY_CACHE.invalidate()
         flash('Company updated successfully', 'success')
         return redirect(url_for('admin_companies'))
     
@@ -3955,8 +6783,13 @@ def delete_company(company_id):
             if os.path.exists(signature_path):
                 os.remove(signature_path)
         
+        for field in COMPANY_ASSET_VARIANTS:
+            if getattr(company, field):
+                remove_company_asset_variants(getattr(company, field), field)
+        
         db.session.delete(company)
         db.session.commit()
+        COMPANY_CACHE.invalidate()
         flash('Company deleted successfully', 'success')
     except Exception as e:
         db.session.rollback()
@@ -3970,7 +6803,7 @@ def select_company_for_doc(emp_id, doc_type):
         return redirect(url_for('admin_login'))
 
     employee = Employee.query.get_or_404(emp_id)
-    companies = Company.query.all()
+    companies = COMPANY_CACHE.all()
 
     if not companies:
         flash('No companies found. Please add a company first.', 'danger')
@@ -3983,7 +6816,7 @@ def select_company_for_doc(emp_id, doc_type):
             flash('Please select a company.', 'danger')
             return redirect(request.url)
 
-        company = Company.query.get(company_id)
+        company = COMPANY_CACHE.get(company_id)
         if not company:
             flash('Selected company does not exist.', 'danger')
             return redirect(request.url)
@@ -4079,6 +6912,76 @@ def select_company_for_doc(emp_id, doc_type):
                            doc_type=doc_type,
                            companies=companies)
 
+# ========== DRIVE DOWNLOAD PROXY ==========
+# Documents that only exist on Drive are streamed to the client in
+# DRIVE_DOWNLOAD_CHUNK_SIZE ranges while each chunk is also spooled to a local
+# cache file, so memory stays at one chunk whatever the PDF size.
+app.config['DRIVE_DOWNLOAD_CHUNK_SIZE'] = int(os.getenv('DRIVE_DOWNLOAD_CHUNK_SIZE', 1024 * 1024))  # bytes
+
+class DriveChunkSpool:
+    """MediaIoBaseDownload target that appends each chunk to the spool file and keeps only the latest"""
+
+    def __init__(self, spool=None):
+        self.spool = spool
+        self.chunk = b''
+
+    def write(self, data):
+        if self.spool is not None:
+            self.spool.write(data)
+        self.chunk = data
+
+def drive_download_stream(service, file_id, local_path, on_complete=None):
+    """
+    Start downloading a Drive file chunk by chunk; returns (total_size, chunks).
+    The first chunk is fetched before returning so Drive errors surface while a
+    redirect is still possible. Chunks are spooled to a temporary file beside
+    local_path that replaces it once the download completes, after which
+    on_complete(local_path) is called. An abandoned download leaves no file.
+    """
+    spool_path = f"{local_path}.part-{uuid.uuid4().hex}"
+    try:
+        spool = open(spool_path, 'wb')
+    except OSError as e:
+        print(f"Could not save local copy: {e}")
+        spool = None
+    sink = DriveChunkSpool(spool)
+    downloader = MediaIoBaseDownload(sink, service.files().get_media(fileId=file_id),
+                                     chunksize=app.config['DRIVE_DOWNLOAD_CHUNK_SIZE'])
+
+    def discard():
+        if spool is not None:
+            spool.close()
+            os.remove(spool_path)
+
+    try:
+        status, done = downloader.next_chunk()
+    except Exception:
+        discard()
+        raise
+
+    def chunks():
+        finished = done
+        try:
+            yield sink.chunk
+            while not finished:
+                _, finished = downloader.next_chunk()
+                yield sink.chunk
+        except BaseException:
+            # Drive failed mid-way or the client went away
+            discard()
+            raise
+        if spool is None:
+            return
+        try:
+            spool.close()
+            os.replace(spool_path, local_path)
+            if on_complete:
+                on_complete(local_path)
+        except Exception as e:
+            print(f"Could not save local copy: {e}")
+
+    return status.total_size, chunks()
+
 @app.route('/download-document/<int:doc_id>')
 def download_document(doc_id):
     if not session.get('is_admin'):
@@ -4118,49 +7021,33 @@ def download_document(doc_id):
                 print(f"Error sending local file {path}: {e}")
                 continue
     
-    # ========== METHOD 2: DOWNLOAD FROM GOOGLE DRIVE ==========
+    # ========== METHOD 2: STREAM FROM GOOGLE DRIVE ==========
     if document.drive_file_id:
         try:
             service, error = get_drive_service()
             if error:
                 flash('Failed to connect to Google Drive', 'danger')
                 return redirect(request.referrer or url_for('admin_dashboard'))
-            
-            # Download file from Drive
-            drive_request = service.files().get_media(fileId=document.drive_file_id)
-            file_data = io.BytesIO()
-            downloader = MediaIoBaseDownload(file_data, drive_request)
-            
-            done = False
-            while not done:
-                status, done = downloader.next_chunk()
-            
-            file_data.seek(0)
-            
-            # Save a local copy for future downloads
-            try:
-                local_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
-                with open(local_path, 'wb') as f:
-                    f.write(file_data.getvalue())
+
+            def saved(local_path):
                 # Update database with local path
-                file_data.seek(0)
                 document.file_path = local_path
                 db.session.commit()
                 print(f"✅ Saved local copy: {local_path}")
-            except Exception as e:
-                print(f"Could not save local copy: {e}")
-                file_data.seek(0)
-            
-            # Send file as download
-            response = make_response(file_data.read())
-            response.headers['Content-Type'] = 'application/pdf'
-            response.headers['Content-Disposition'] = f'attachment; filename={document.filename}'
-            return response
-            
+
+            local_path = os.path.join(app.config['UPLOAD_FOLDER'], document.filename)
+            total_size, chunks = drive_download_stream(service, document.drive_file_id, local_path, on_complete=saved)
         except Exception as e:
             print(f"Error downloading from Drive: {e}")
             flash(f'Error downloading from Drive: {str(e)}', 'danger')
             return redirect(request.referrer or url_for('admin_dashboard'))
+
+        # Chunks go to the client as they arrive while the local copy is written
+        response = Response(stream_with_context(chunks), mimetype='application/pdf')
+        response.headers['Content-Disposition'] = f'attachment; filename={document.filename}'
+        if total_size:
+            response.headers['Content-Length'] = str(total_size)
+        return response
     
     # ========== FILE NOT FOUND ANYWHERE ==========
     flash(f'File not found: {document.filename}. The file may have been deleted.', 'danger')
@@ -4229,6 +7116,7 @@ def delete_document(doc_id):
                     
                     # Delete the increment history record
                     db.session.delete(increment_history)
+                    employee.refresh_ctc()
                     print(f"   ✅ Increment history record deleted")
                     print(f"   ✅ Employee CTC reverted to: ₹{employee.ctc:,.2f}")
                     print(f"{'='*60}\n")
@@ -4238,22 +7126,6 @@ def delete_document(doc_id):
                 else:
                     print(f"⚠️ No increment history found for employee {employee.full_name}")
         
-        # ========== DELETE FROM GOOGLE DRIVE ==========
-        if document.drive_file_id:
-            try:
-                # Delete the file from Drive
-                delete_drive_file(document.drive_file_id)
-                print(f"✅ Deleted from Drive: {document.drive_file_id}")
-                
-                # Check if parent folder is empty and delete it
-                parent_id = get_parent_folder_id(document.drive_file_id)
-                if parent_id and is_folder_empty(parent_id):
-                    delete_drive_folder(parent_id)
-                    print(f"✅ Deleted empty parent folder: {parent_id}")
-                    
-            except Exception as e:
-                print(f"Drive deletion error (continuing anyway): {e}")
-        
         # ========== DELETE LOCAL FILE ==========
         if document.file_path and os.path.exists(document.file_path):
             try:
@@ -4263,9 +7135,14 @@ def delete_document(doc_id):
                 print(f"Error deleting local file: {e}")
         
         # ========== DELETE DATABASE RECORD ==========
+        drive_file_id = document.drive_file_id
         db.session.delete(document)
         db.session.commit()
         
+        # ========== DELETE FROM GOOGLE DRIVE ==========
+        # The file and its folder, if that leaves it empty, go in the background
+        schedule_drive_cleanup(f'Deleted {doc_filename}', redirect_url, [drive_file_id])
+        
         flash(f'✅ {doc_type_name} document "{doc_filename}" deleted successfully!', 'success')
         
         return redirect(redirect_url)
@@ -4279,19 +7156,41 @@ def delete_document(doc_id):
         return redirect(request.referrer or url_for('admin_dashboard'))
 
 # ==================== PAYMENT ROUTES ====================
-@app.route('/admin/payments')
-def view_payments():
-    """View all employee payments with filters"""
-    if not session.get('is_admin'):
-        return redirect(url_for('admin_login'))
+def _int_in_range(value, low, high):
+    """int(value) if it parses and low <= it <= high, else None"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if low <= value <= high else None
+
+def payment_list_filters():
+    """Filter values from the query string and the matching Payment clauses"""
+    values = {
+        'status': request.args.get('status', 'all'),
+        'employee_id': request.args.get('employee_id', type=int),
+        'month': request.args.get('month', ''),
+        'year': request.args.get('year', datetime.now().year),
+    }
+
+    filters = []
+    if values['status'] != 'all':
+        filters.append(Payment.status == values['status'])
     
-    # Get filter parameters
-    status_filter = request.args.get('status', 'all')
-    employee_filter = request.args.get('employee_id', type=int)
-    month_filter = request.args.get('month', '')
-    year_filter = request.args.get('year', datetime.now().year)
+    if values['employee_id']:
+        filters.append(Payment.employee_id == values['employee_id'])
     
-    # Build query for employee payments - ADD phone number
+    # Month / year become payment_date ranges; NULL payment_date stays included.
+    # Values that aren't a valid month or year are ignored.
+    month = _int_in_range(values['month'], 1, 12)
+    year = _int_in_range(values['year'], MINYEAR, MAXYEAR - 1)
+    if month or year:
+        years = payment_date_years() if month and not year else ()
+        filters.append(payment_period_filter(month, year, years))
+    return values, filters
+
+def payment_list_page(filters):
+    """The requested page of filtered payments joined with employee details"""
     query = db.session.query(
         Payment.id,
         Payment.amount,
@@ -4305,108 +7204,94 @@ def view_payments():
         Employee.employee_id.label('employee_id'),
         Employee.email.label('employee_email'),
         Employee.phone.label('employee_phone')  # ← ADD PHONE NUMBER
-    ).join(Employee, Payment.employee_id == Employee.id)
-    
-    # Apply filters
-    if status_filter != 'all':
-        query = query.filter(Payment.status == status_filter)
-    
-    if employee_filter:
-        query = query.filter(Payment.employee_id == employee_filter)
+    ).join(Employee, Payment.employee_id == Employee.id).filter(*filters)
+    return keyset_page(query, Payment.created_at, Payment.id, app.config['PAYMENTS_PER_PAGE'])
+
+@app.route('/admin/payments')
+def view_payments():
+    """View all employee payments with filters"""
+    if not session.get('is_admin'):
+        return redirect(url_for('admin_login'))
     
-    # Include NULL payment_date in filters
-    if month_filter:
-        query = query.filter(
-            db.or_(
-                Payment.payment_date.is_(None),
-                db.extract('month', Payment.payment_date) == int(month_filter)
-            )
-        )
+    filter_values, filters = payment_list_filters()
     
-    if year_filter:
-        query = query.filter(
-            db.or_(
-                Payment.payment_date.is_(None),
-                db.extract('year', Payment.payment_date) == int(year_filter)
-            )
-        )
+    # Totals and status counts for the summary cards come from one GROUP BY
+    summary = payment_summary(filters)
     
-    results = query.order_by(Payment.created_at.desc()).all()
+    # Fetch only the page of payments being displayed
+    results, pagination = payment_list_page(filters)
     
     # Process results
     payments = []
-    total_amount = 0
-    total_paid = 0
-    total_due = 0
-    
     for row in results:
-        payment_id = row[0]
-        amount = row[1]
-        paid_amt = row[2]
-        document_type = row[3]
-        status = row[4]
-        payment_date = row[5]
-        due_date = row[6]
-        created_at = row[7]
-        employee_name = row[8]
-        employee_id = row[9]
-        employee_email = row[10]
-        employee_phone = row[11]  # ← GET PHONE NUMBER
-        
-        due_amount = amount - paid_amt
-        total_amount += amount
-        total_paid += paid_amt
-        total_due += due_amount
-        
-        # Determine status class for badge
-        if paid_amt >= amount:
-            status_class = 'success'
-        elif paid_amt > 0:
-            status_class = 'warning'
-        else:
-            status_class = 'secondary'
-        
         payments.append({
-            'id': payment_id,
-            'employee_name': employee_name,
-            'employee_id': employee_id,
-            'employee_email': employee_email,
-            'employee_phone': employee_phone or 'N/A',  # ← ADD PHONE NUMBER
-            'amount': amount,
-            'paid_amt': paid_amt,
-            'due_amount': due_amount,
-            'status': status,
-            'status_class': status_class,
-            'payment_date': payment_date.strftime('%d %b %Y') if payment_date else 'Not Paid Yet',
-            'due_date': due_date.strftime('%d %b %Y') if due_date else 'N/A',
-            'created_at': created_at.strftime('%d %b %Y') if created_at else 'N/A',
+            'id': row.id,
+            'employee_name': row.employee_name,
+            'employee_id': row.employee_id,
+            'employee_email': row.employee_email,
+            'employee_phone': row.employee_phone or 'N/A',  # ← ADD PHONE NUMBER
+            'amount': row.amount,
+            'paid_amt': row.paid_amt,
+            'due_amount': row.amount - row.paid_amt,
+            'status': row.status,
+            'status_class': payment_status_class(row.status),
+            'payment_date': row.payment_date.strftime('%d %b %Y') if row.payment_date else 'Not Paid Yet',
+            'due_date': row.due_date.strftime('%d %b %Y') if row.due_date else 'N/A',
+            'created_at': row.created_at.strftime('%d %b %Y') if row.created_at else 'N/A',
         })
     
     # Get all employees for the create payment dropdown
     employees = Employee.query.all()
     
-    # Calculate counts for summary cards
-    paid_count = sum(1 for p in payments if p['status'] == 'Paid')
-    pending_count = sum(1 for p in payments if p['status'] == 'Pending')
-    partial_count = sum(1 for p in payments if p['status'] == 'Partial')
-    overdue_count = sum(1 for p in payments if p['status'] == 'Overdue')
-    
     return render_template('payments.html',
                          payments=payments,
+                         pagination=pagination,
+                         pagination_total=summary['count'],
                          employees=employees,
-                         total_amount=total_amount,
-                         total_paid=total_paid,
-                         total_due=total_due,
-                         paid_count=paid_count,
-                         pending_count=pending_count,
-                         partial_count=partial_count,
-                         overdue_count=overdue_count,
-                         status_filter=status_filter,
-                         employee_filter=employee_filter,
-                         month_filter=month_filter,
-                         year_filter=year_filter,
+                         total_amount=summary['total_amount'],
+                         total_paid=summary['total_paid'],
+                         total_due=summary['total_due'],
+                         paid_count=summary['counts']['Paid'],
+                         pending_count=summary['counts']['Pending'],
+                         partial_count=summary['counts']['Partial'],
+                         overdue_count=summary['counts']['Overdue'],
+                         status_filter=filter_values['status'],
+                         employee_filter=filter_values['employee_id'],
+                         month_filter=filter_values['month'],
+                         year_filter=filter_values['year'],
                          now=datetime.now())
 
+@app.route('/admin/api/payments')
+def api_payments():
+    """JSON page of payments; takes the same filters as /admin/payments plus after/before
+    cursors. Totals are only included with the first page."""
+    if not session.get('is_admin'):
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    _, filters = payment_list_filters()
+    results, page = payment_list_page(filters)
+    summary = payment_summary(filters) if not page['paged'] else None
+    
+    return jsonify({
+        'payments': [{
+            'id': row.id,
+            'employee_name': row.employee_name,
+            'employee_id': row.employee_id,
+            'employee_email': row.employee_email,
+            'employee_phone': row.employee_phone,
+            'document_type': row.document_type,
+            'amount': row.amount,
+            'paid_amt': row.paid_amt,
+            'due_amount': row.amount - row.paid_amt,
+            'status': row.status,
+            'payment_date': row.payment_date.isoformat() if row.payment_date else None,
+            'due_date': row.due_date.isoformat() if row.due_date else None,
+            'created_at': row.created_at.isoformat() if row.created_at else None,
+        } for row in results],
+        'summary': summary,
+        'page': page,
+    })
+
 @app.route('/admin/payment/<int:payment_id>')
 def view_payment(payment_id):
     """View single payment details"""
@@ -4756,6 +7641,10 @@ if __name__ == '__main__':
             print("🔄 Creating database tables...")
             db.create_all()
             print("✅ Database tables created successfully!")
+
+            if db.session.get(DashboardCounter, COUNTERS_BUILT) is None:
+                rebuild_dashboard_counters()
+                print("✅ Dashboard counters built")
             
             # Create default admin if none exists
             if Admin.query.first() is None: